@@ -8,6 +8,8 @@ class BlockedUnlockPickup(RoomGrid):
     in another room
     """
 
+    state_attrs = ('obj',)
+
     def __init__(self, seed=None):
         room_size = 6
         super().__init__(
@@ -7,6 +7,8 @@ class FetchEnv(MiniGridEnv):
     named using English text strings
     """
 
+    state_attrs = ('targetType', 'targetColor')
+
     def __init__(
         self,
         size=8,
@@ -7,6 +7,8 @@ class GoToObjectEnv(MiniGridEnv):
     named using an English text string
     """
 
+    state_attrs = ('targetType', 'target_color', 'target_pos')
+
     def __init__(
         self,
         size=6,
@@ -8,6 +8,8 @@ class MTEnv(MiniGridEnv):
     are placed in a gridworld. The a static goal is also present
     """
 
+    state_attrs = ('tile_rewards',)
+
     def __init__(
         self,
         size=12,
@@ -86,10 +88,8 @@ class MTEnv(MiniGridEnv):
             self.tile_rewards = tile_rewards
 
     def set_wall_colour(self, colour = None):
-        for obj in self.grid.grid:
-            if obj is not None:
-                if obj.type == "wall":
-                    obj.color = colour
+        for pos in self.grid.find("wall"):
+            self.grid.get(*pos).color = colour
 
     def step(self, action):
         obs, reward, done, info = MiniGridEnv.step(self, action)
@@ -103,15 +103,9 @@ class MTEnv(MiniGridEnv):
         return obs, reward, done, info
 
     def possible_object_rewards(self):
-        # TODO can make this more efficent by keeping track of the tiles
-        # will need to reinit whatever tracker is being
-        # used when set_wall_colour is called
-
         max_obj_r = 0
-        for obj in self.grid.grid:
-            if obj is not None:
-                if obj.type == "floor" and obj.color in self.tile_colours:
-                    max_obj_r += np.max([0,self.tile_rewards[obj.color]])
+        for colour in self.tile_colours:
+            max_obj_r += self.grid.count("floor", colour) * max(0, self.tile_rewards[colour])
 
         return max_obj_r
 
@@ -195,6 +189,7 @@ class MTEnvFourRoomsStaticWalls(MTEnv):
     """
     Static FourRooms
     """
+
     def __init__(self):
         self._agent_default_pos = (1,1)  
         self._goal_default_pos = (17,17)
@@ -8,6 +8,8 @@ class ObstructedMazeEnv(RoomGrid):
     doors may be obstructed by a ball and keys may be hidden in boxes.
     """
 
+    state_attrs = ('obj',)
+
     def __init__(self,
         num_rows,
         num_cols,
@@ -7,6 +7,8 @@ class PutNearEnv(MiniGridEnv):
     another object through a natural language string.
     """
 
+    state_attrs = ('move_type', 'moveColor', 'target_type', 'target_color', 'target_pos')
+
     def __init__(
         self,
         size=6,
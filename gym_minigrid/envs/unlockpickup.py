@@ -7,6 +7,8 @@ class UnlockPickup(RoomGrid):
     Unlock a door, then pick up a box in another room
     """
 
+    state_attrs = ('obj',)
+
     def __init__(self, seed=None):
         room_size = 6
         super().__init__(
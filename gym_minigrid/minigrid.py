@@ -1,7 +1,8 @@
 import math
-import hashlib
+import copy
 import gym
 from enum import IntEnum
+from collections import namedtuple
 import numpy as np
 from gym import error, spaces, utils
 from gym.utils import seeding
@@ -58,6 +59,18 @@ STATE_TO_IDX = {
     'locked': 2,
 }
 
+# Bit offsets of the color and state of a cell in its packed encoding,
+# type | color << 4 | state << 7, see Grid.pack
+PACKED_COLOR_SHIFT = 4
+PACKED_STATE_SHIFT = 7
+PACKED_CELL_BITS = 9
+
+# Encoding of an empty cell
+EMPTY_ENCODING = (OBJECT_TO_IDX['empty'], 0, 0)
+
+# Encoding of the walls surrounding the grid
+WALL_ENCODING = np.array((OBJECT_TO_IDX['wall'], COLOR_TO_IDX['grey'], 0), dtype=np.uint8)
+
 # Map of agent direction indices to vectors
 DIR_TO_VEC = [
     # Pointing right (positive X)
@@ -70,6 +83,10 @@ DIR_TO_VEC = [
     np.array((0, -1)),
 ]
 
+# Map of agent direction indices to the vectors pointing to the right of
+# the agent
+DIR_TO_RIGHT_VEC = [np.array((-dy, dx)) for dx, dy in DIR_TO_VEC]
+
 class WorldObj:
     """
     Base class for grid world objects
@@ -78,6 +95,12 @@ class WorldObj:
     def __init__(self, type, color):
         assert type in OBJECT_TO_IDX, type
         assert color in COLOR_TO_IDX, color
+
+        # Grid and cell this object was last placed into. The grid is
+        # notified when the encoding of the object changes.
+        self._grid = None
+        self._grid_pos = None
+
         self.type = type
         self.color = color
         self.contains = None
@@ -88,6 +111,21 @@ class WorldObj:
         # Current position of the object
         self.cur_pos = None
 
+    @property
+    def color(self):
+        return self._color
+
+    @color.setter
+    def color(self, color):
+        self._color = color
+        self._changed()
+
+    def _changed(self):
+        """Refresh the grid cell holding this object after a state change"""
+        if self._grid is not None:
+            self._grid._record(*self._grid_pos)
+            self._grid._update(*self._grid_pos)
+
     def can_overlap(self):
         """Can the agent overlap with this?"""
         return False
@@ -112,6 +150,10 @@ class WorldObj:
         """Encode the a description of this object as a 3-tuple of integers"""
         return (OBJECT_TO_IDX[self.type], COLOR_TO_IDX[self.color], 0)
 
+    def _apply_encoding(self, color_idx, state):
+        """Restore the color and state of this object from its encoding"""
+        self.color = IDX_TO_COLOR[color_idx]
+
     @staticmethod
     def decode(type_idx, color_idx, state):
         """Create an object from a 3-tuple state description"""
@@ -216,6 +258,24 @@ class Door(WorldObj):
         self.is_open = is_open
         self.is_locked = is_locked
 
+    @property
+    def is_open(self):
+        return self._is_open
+
+    @is_open.setter
+    def is_open(self, is_open):
+        self._is_open = is_open
+        self._changed()
+
+    @property
+    def is_locked(self):
+        return self._is_locked
+
+    @is_locked.setter
+    def is_locked(self, is_locked):
+        self._is_locked = is_locked
+        self._changed()
+
     def can_overlap(self):
         """The agent can only walk over this cell when the door is open"""
         return self.is_open
@@ -248,6 +308,11 @@ class Door(WorldObj):
 
         return (OBJECT_TO_IDX[self.type], COLOR_TO_IDX[self.color], state)
 
+    def _apply_encoding(self, color_idx, state):
+        self.color = IDX_TO_COLOR[color_idx]
+        self.is_open = state == 0
+        self.is_locked = state == 2
+
     def render(self, img):
         c = COLORS[self.color]
 
@@ -329,11 +394,36 @@ class Box(WorldObj):
 class Grid:
     """
     Represent a grid and operations on it
+
+    The contents of the grid are stored twice, and both copies are kept in
+    sync by `set` and by the objects themselves when their state changes:
+    - `grid`, a flat array of the objects occupying each cell
+    - `_array`, a (width, height, 3) uint8 array holding the
+      (type, color, state) encoding of each cell
+    - `_see_behind`, a (width, height) boolean array telling which cells
+      do not block the agent's sight
+    Bulk operations (encode, slice, rotate_left) work on the arrays only.
     """
 
     # Static cache of pre-renderer tiles
     tile_cache = {}
 
+    # Tile atlases used to render tiles, indexed by tile size
+    tile_atlases = {}
+
+    # View widths for which visibility is computed using precomputed
+    # lookup tables indexed by the bitmasks of each row
+    vis_table_sizes = (3, 5, 7)
+
+    # Static cache of visibility lookup tables, indexed by width
+    vis_tables = {}
+
+    # Static cache of the weights of the bits packing a row, indexed by width
+    vis_weights = {}
+
+    # Static cache of Zobrist hashing keys, indexed by (width, height)
+    zobrist_tables = {}
+
     def __init__(self, width, height):
         assert width >= 3
         assert height >= 3
@@ -341,27 +431,244 @@ class Grid:
         self.width = width
         self.height = height
 
-        self.grid = [None] * width * height
+        # Objects occupying each cell, indexed by j * width + i
+        self.grid = np.full(width * height, None, dtype=object)
+
+        # Type, color and state planes, indexed by [i, j]
+        self._array = np.zeros((width, height, 3), dtype=np.uint8)
+        self._array[:, :, 0] = OBJECT_TO_IDX['empty']
+
+        # Transparency plane, indexed by [i, j]
+        self._see_behind = np.ones((width, height), dtype=bool)
+
+        self._make_views()
+
+        # Zobrist hash of the encoding, computed on first use and then
+        # updated as cells change, None when it needs to be recomputed
+        self._hash = None
+
+        # Positions of the objects of each (type, color) index pair, built
+        # on first use and then updated like the hash
+        self._index = None
+
+        # Previous contents of the cells modified, in order, when changes
+        # are journaled so that they can be reverted
+        self._journal = None
+
+    def _make_views(self):
+        """
+        Create memoryviews of the encoding and transparency planes, which
+        are much cheaper than numpy indexing for writing single cells
+        """
+
+        self._array_view = memoryview(self._array)
+        self._see_behind_view = memoryview(self._see_behind)
+
+    def __getstate__(self):
+        # Memoryviews cannot be pickled or copied
+        state = self.__dict__.copy()
+        del state['_array_view']
+        del state['_see_behind_view']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._make_views()
+
+    @staticmethod
+    def _from_arrays(array, see_behind, cells):
+        """
+        Create a grid from its encoding, transparency and object arrays.
+        The objects are shared with their original grid, which remains the
+        one they report state changes to.
+        """
+
+        width, height = cells.shape
+        grid = Grid(width, height)
+        grid.grid[:] = cells.T.reshape(-1)
+        grid._array[:] = array
+        grid._see_behind[:] = see_behind
+        return grid
+
+    @property
+    def encoding(self):
+        """
+        Read-only view of the grid encoding. This is kept up to date as the
+        grid changes and is not copied, use encode() to get a private copy.
+        """
+
+        array = self._array.view()
+        array.flags.writeable = False
+        return array
+
+    def _cells(self):
+        """
+        View of the objects occupying each cell, indexed by [i, j]
+        """
+
+        return self.grid.reshape(self.height, self.width).T
+
+    def _update(self, i, j):
+        """
+        Refresh the encoding of a cell from the object occupying it
+        """
+
+        v = self.grid[j * self.width + i]
+
+        # Only the hash and the object index need the previous encoding
+        tracked = self._hash is not None or self._index is not None
+        if tracked:
+            old = tuple(self._array[i, j].tolist())
+
+        if v is None:
+            type_idx, color_idx, state = EMPTY_ENCODING
+            self._see_behind_view[i, j] = True
+        else:
+            type_idx, color_idx, state = v.encode()
+            self._see_behind_view[i, j] = v.see_behind()
+        array = self._array_view
+        array[i, j, 0] = type_idx
+        array[i, j, 1] = color_idx
+        array[i, j, 2] = state
+
+        if tracked:
+            self._track(i, j, old)
+
+    def _track(self, i, j, old):
+        """
+        Update the hash and the object index after the encoding of a cell
+        changed from old
+        """
+
+        if self._hash is None and self._index is None:
+            return
+
+        new = tuple(self._array[i, j].tolist())
+        if new == old:
+            return
+
+        if self._hash is not None:
+            keys = Grid._zobrist_keys(self.width, self.height)[0]
+            idx = j * self.width + i
+            self._hash ^= int(keys[(idx,) + old]) ^ int(keys[(idx,) + new])
+
+        if self._index is not None:
+            if old[0] != OBJECT_TO_IDX['empty']:
+                self._index[old[:2]].discard((i, j))
+            if new[0] != OBJECT_TO_IDX['empty']:
+                self._index.setdefault(new[:2], set()).add((i, j))
+
+    def _record(self, i, j, v=None):
+        """
+        Journal the contents of a cell before it changes, along with the
+        position of the object v about to be put in it
+        """
+
+        if self._journal is not None:
+            old = self.grid[j * self.width + i]
+            self._journal.append((
+                j * self.width + i,
+                old,
+                old.cur_pos if old is not None else None,
+                tuple(self._array[i, j].tolist()),
+                self._see_behind[i, j],
+                v,
+                v.cur_pos if v is not None else None
+            ))
+
+    def _restore_cell(self, i, j, v, cur_pos, encoding, see_behind):
+        """
+        Put back an object in a cell, along with its position and the
+        color and state it had when the cell was encoded
+        """
+
+        idx = j * self.width + i
+        old = self.grid[idx]
+        if old is not None and old._grid is self and old._grid_pos == (i, j):
+            old._grid = None
+
+        self.grid[idx] = v
+        if v is not None:
+            v._grid = None
+            v._apply_encoding(encoding[1], encoding[2])
+            v._grid = self
+            v._grid_pos = (i, j)
+            v.cur_pos = cur_pos
+
+        old = tuple(self._array[i, j].tolist())
+        self._array[i, j] = encoding
+        self._see_behind[i, j] = see_behind
+        self._track(i, j, old)
+
+    def _rewind(self, length):
+        """
+        Revert the changes journaled after the first length entries
+        """
+
+        while len(self._journal) > length:
+            idx, v, cur_pos, encoding, see_behind, new, new_pos = self._journal.pop()
+            i, j = idx % self.width, idx // self.width
+            self._restore_cell(i, j, v, cur_pos, encoding, see_behind)
+            if new is not None and new is not v:
+                new.cur_pos = new_pos
+
+    @classmethod
+    def _zobrist_keys(cls, width, height):
+        """
+        Get the random 64-bit keys used to hash states on a grid of a given
+        size. These are, in order, the keys of each (cell, type, color, state)
+        combination, of each agent position, of each agent direction and
+        of each (type, color, state) of the carried object. Empty cells have
+        a null key, so that the hash of an empty grid is zero. The keys are
+        generated with a fixed seed and are the same in every process.
+        """
+
+        key = (width, height)
+        if key not in cls.zobrist_tables:
+            num_types = len(OBJECT_TO_IDX)
+            num_colors = len(COLOR_TO_IDX)
+            rng = np.random.RandomState(width * 1000 + height)
+
+            def rand_keys(*shape):
+                return rng.randint(0, 2**64, size=shape, dtype=np.uint64)
+
+            cell_keys = rand_keys(width * height, num_types, num_colors, 3)
+            cell_keys[:, OBJECT_TO_IDX['empty']] = 0
+            agent_keys = rand_keys(width * height)
+            dir_keys = rand_keys(4)
+            carrying_keys = rand_keys(num_types, num_colors, 3)
+
+            cls.zobrist_tables[key] = (cell_keys, agent_keys, dir_keys, carrying_keys)
+
+        return cls.zobrist_tables[key]
+
+    def zobrist_hash(self):
+        """
+        64-bit Zobrist hash of the grid encoding, as an integer. The hash is
+        computed on the first call and then maintained as cells change, so
+        that subsequent calls are constant time.
+        """
+
+        if self._hash is None:
+            keys = Grid._zobrist_keys(self.width, self.height)[0]
+            codes = self._array.transpose(1, 0, 2).reshape(-1, 3)
+            cell_keys = keys[np.arange(len(codes)), codes[:, 0], codes[:, 1], codes[:, 2]]
+            self._hash = int(np.bitwise_xor.reduce(cell_keys))
+
+        return self._hash
 
     def __contains__(self, key):
         if isinstance(key, WorldObj):
-            for e in self.grid:
-                if e is key:
+            for i, j in self.find(key.type, key.color):
+                if self.get(i, j) is key:
                     return True
         elif isinstance(key, tuple):
-            for e in self.grid:
-                if e is None:
-                    continue
-                if (e.color, e.type) == key:
-                    return True
-                if key[0] is None and key[1] == e.type:
-                    return True
+            color, type = key
+            return self.count(type, color) > 0
         return False
 
     def __eq__(self, other):
-        grid1  = self.encode()
-        grid2 = other.encode()
-        return np.array_equal(grid2, grid1)
+        return np.array_equal(self._array, other._array)
 
     def __ne__(self, other):
         return not self == other
@@ -373,24 +680,136 @@ class Grid:
     def set(self, i, j, v):
         assert i >= 0 and i < self.width
         assert j >= 0 and j < self.height
-        self.grid[j * self.width + i] = v
+
+        if self._journal is not None:
+            self._record(i, j, v)
+
+        idx = j * self.width + i
+        old = self.grid[idx]
+        if old is not None and old._grid is self and old._grid_pos == (i, j):
+            old._grid = None
+
+        self.grid[idx] = v
+        if v is not None:
+            v._grid = self
+            v._grid_pos = (i, j)
+
+        self._update(i, j)
+
+    def free_cells(self, top=(0, 0), size=None):
+        """
+        Get the positions of the empty cells within a rectangle, as arrays
+        of x and y coordinates. The rectangle is clipped to the grid.
+        """
+
+        if size is None:
+            size = (self.width, self.height)
+
+        x0, y0 = max(top[0], 0), max(top[1], 0)
+        x1 = min(top[0] + size[0], self.width)
+        y1 = min(top[1] + size[1], self.height)
+
+        types = self._array[x0:x1, y0:y1, 0]
+        xs, ys = np.nonzero(types == OBJECT_TO_IDX['empty'])
+
+        return xs + x0, ys + y0
+
+    def _get_index(self):
+        if self._index is None:
+            self._index = {}
+            xs, ys = np.nonzero(self._array[:, :, 0] != OBJECT_TO_IDX['empty'])
+            codes = self._array[xs, ys, :2].tolist()
+            for i, j, code in zip(xs.tolist(), ys.tolist(), codes):
+                self._index.setdefault(tuple(code), set()).add((i, j))
+
+        return self._index
+
+    def _index_sets(self, type, color):
+        index = self._get_index()
+        type_idx = OBJECT_TO_IDX[type]
+
+        if color is not None:
+            return [index.get((type_idx, COLOR_TO_IDX[color]), ())]
+
+        return [
+            index.get((type_idx, color_idx), ())
+            for color_idx in IDX_TO_COLOR
+        ]
+
+    def find(self, type, color=None):
+        """
+        Get the positions of the objects of a given type, and optionally
+        of a given color. The object index is built on the first query and
+        then maintained as cells change.
+        """
+
+        positions = []
+        for cells in self._index_sets(type, color):
+            positions.extend(cells)
+        return positions
+
+    def count(self, type, color=None):
+        """
+        Count the objects of a given type, and optionally of a given color
+        """
+
+        return sum(len(cells) for cells in self._index_sets(type, color))
 
     def get(self, i, j):
         assert i >= 0 and i < self.width
         assert j >= 0 and j < self.height
         return self.grid[j * self.width + i]
 
+    def _fill(self, x, y, w, h, obj_type):
+        """
+        Put a new obj_type object in each cell of a rectangle, writing the
+        encoding and transparency planes in bulk
+        """
+
+        assert x >= 0 and x + w <= self.width
+        assert y >= 0 and y + h <= self.height
+
+        # The hash, object index and journal are updated cell by cell
+        if self._hash is not None or self._index is not None or self._journal is not None:
+            for j in range(y, y + h):
+                for i in range(x, x + w):
+                    self.set(i, j, obj_type())
+            return
+
+        if w <= 0 or h <= 0:
+            return
+
+        cells = self._cells()[x:x+w, y:y+h]
+
+        # Detach the objects being replaced
+        occupied = self._array[x:x+w, y:y+h, 0] != OBJECT_TO_IDX['empty']
+        for i, j in zip(*np.nonzero(occupied)):
+            old = cells[i, j]
+            if old._grid is self and old._grid_pos == (x + i, y + j):
+                old._grid = None
+
+        objs = np.empty((w, h), dtype=object)
+        for i in range(w):
+            for j in range(h):
+                v = obj_type()
+                v._grid = self
+                v._grid_pos = (x + i, y + j)
+                objs[i, j] = v
+        cells[:] = objs
+
+        # Objects created with the default arguments encode identically
+        self._array[x:x+w, y:y+h] = v.encode()
+        self._see_behind[x:x+w, y:y+h] = v.see_behind()
+
     def horz_wall(self, x, y, length=None, obj_type=Wall):
         if length is None:
             length = self.width - x
-        for i in range(0, length):
-            self.set(x + i, y, obj_type())
+        self._fill(x, y, length, 1, obj_type)
 
     def vert_wall(self, x, y, length=None, obj_type=Wall):
         if length is None:
             length = self.height - y
-        for j in range(0, length):
-            self.set(x, y + j, obj_type())
+        self._fill(x, y, 1, length, obj_type)
 
     def wall_rect(self, x, y, w, h):
         self.horz_wall(x, y, w)
@@ -403,36 +822,56 @@ class Grid:
         Rotate the grid to the left (counter-clockwise)
         """
 
-        grid = Grid(self.height, self.width)
+        # Arrays are indexed by [x, y] with y pointing down, so a rotation
+        # to the left on screen is a clockwise rotation of the array
+        array = np.rot90(self._array, k=-1)
+        see_behind = np.rot90(self._see_behind, k=-1)
+        cells = np.rot90(self._cells(), k=-1)
 
-        for i in range(self.width):
-            for j in range(self.height):
-                v = self.get(i, j)
-                grid.set(j, grid.height - 1 - i, v)
-
-        return grid
+        return Grid._from_arrays(array, see_behind, cells)
 
     def slice(self, topX, topY, width, height):
         """
         Get a subset of the grid
         """
 
-        grid = Grid(width, height)
+        array, see_behind = self.slice_arrays(topX, topY, width, height)
 
-        for j in range(0, height):
-            for i in range(0, width):
-                x = topX + i
-                y = topY + j
+        # Cells outside of the grid are filled with walls
+        cells = np.full((width, height), Wall(), dtype=object)
+        x0, y0 = max(topX, 0), max(topY, 0)
+        x1 = min(topX + width, self.width)
+        y1 = min(topY + height, self.height)
+        if x0 < x1 and y0 < y1:
+            cells[x0-topX:x1-topX, y0-topY:y1-topY] = self._cells()[x0:x1, y0:y1]
 
-                if x >= 0 and x < self.width and \
-                   y >= 0 and y < self.height:
-                    v = self.get(x, y)
-                else:
-                    v = Wall()
+        return Grid._from_arrays(array, see_behind, cells)
 
-                grid.set(i, j, v)
+    def slice_arrays(self, topX, topY, width, height, out=None):
+        """
+        Get the encoding and transparency arrays of a subset of the grid,
+        without creating a new grid. Cells outside of the grid are walls.
+        The arrays are written into out when given, as a pair of uint8
+        (width, height, 3) and boolean (width, height) arrays.
+        """
 
-        return grid
+        if out is None:
+            array = np.empty((width, height, 3), dtype=np.uint8)
+            see_behind = np.empty((width, height), dtype=bool)
+        else:
+            array, see_behind = out
+        array[:, :] = WALL_ENCODING
+        see_behind[:, :] = False
+
+        # Copy the part of the subset overlapping the grid
+        x0, y0 = max(topX, 0), max(topY, 0)
+        x1 = min(topX + width, self.width)
+        y1 = min(topY + height, self.height)
+        if x0 < x1 and y0 < y1:
+            array[x0-topX:x1-topX, y0-topY:y1-topY] = self._array[x0:x1, y0:y1]
+            see_behind[x0-topX:x1-topX, y0-topY:y1-topY] = self._see_behind[x0:x1, y0:y1]
+
+        return array, see_behind
 
     @classmethod
     def render_tile(
@@ -444,9 +883,13 @@ class Grid:
         subdivs=3
     ):
         """
-        Render a tile and cache the result
+        Render a tile and cache the result. Tiles are taken from the atlas
+        registered for this tile size with use_atlas, if any.
         """
 
+        if subdivs == 3 and tile_size in cls.tile_atlases:
+            return cls.tile_atlases[tile_size].tile(obj, agent_dir, highlight)
+
         # Hash map lookup key for the cache
         key = (agent_dir, highlight, tile_size)
         key = obj.encode() + key if obj else key
@@ -454,6 +897,25 @@ class Grid:
         if key in cls.tile_cache:
             return cls.tile_cache[key]
 
+        img = cls.draw_tile(obj, agent_dir, highlight, tile_size, subdivs)
+
+        # Cache the rendered tile
+        cls.tile_cache[key] = img
+
+        return img
+
+    @staticmethod
+    def draw_tile(
+        obj,
+        agent_dir=None,
+        highlight=False,
+        tile_size=TILE_PIXELS,
+        subdivs=3
+    ):
+        """
+        Render a tile as a uint8 image, without caching
+        """
+
         img = np.zeros(shape=(tile_size * subdivs, tile_size * subdivs, 3), dtype=np.uint8)
 
         # Draw the grid lines (top and left edges)
@@ -480,78 +942,138 @@ class Grid:
             highlight_img(img)
 
         # Downsample the image to perform supersampling/anti-aliasing
-        img = downsample(img, subdivs)
-
-        # Cache the rendered tile
-        cls.tile_cache[key] = img
+        img = downsample(img, subdivs).astype(np.uint8)
 
         return img
 
-    def render(
-        self,
+    @classmethod
+    def use_atlas(cls, atlas):
+        """
+        Render the tiles of the size of an atlas from this atlas
+        """
+
+        cls.tile_atlases[atlas.tile_size] = atlas
+
+    @classmethod
+    def get_atlas(cls, tile_size):
+        """
+        Get the atlas used for a tile size, creating an empty one whose
+        tiles get drawn as they are needed if none was registered
+        """
+
+        if tile_size not in cls.tile_atlases:
+            cls.use_atlas(TileAtlas.empty(tile_size))
+
+        return cls.tile_atlases[tile_size]
+
+    def tile_indices(self, agent_pos=None, agent_dir=None, highlight_mask=None):
+        """
+        Get the (width, height) array of the atlas indices of the tiles
+        of this grid
+        """
+
+        return Grid.encoding_indices(self._array, agent_pos, agent_dir, highlight_mask)
+
+    @staticmethod
+    def encoding_indices(array, agent_pos=None, agent_dir=None, highlight_mask=None):
+        """
+        Get the atlas indices of the tiles of an array grid encoding, or of
+        a stack of encodings of shape (..., width, height, 3). The agent
+        positions, directions and highlight masks are broadcast against
+        the leading dimensions.
+        """
+
+        idx = TileAtlas.cell_indices[array[..., 0], array[..., 1], array[..., 2]]
+
+        if highlight_mask is not None:
+            idx += np.asarray(highlight_mask, dtype=bool)
+
+        # Overlay the agents which are inside their grid
+        if agent_pos is None or agent_dir is None:
+            return idx
+
+        width, height = idx.shape[-2:]
+
+        if idx.ndim == 2:
+            i, j = agent_pos
+            if 0 <= i < width and 0 <= j < height:
+                idx[i, j] += 2 * (agent_dir + 1)
+        else:
+            batch_shape = idx.shape[:-2]
+            agent_pos = np.broadcast_to(agent_pos, batch_shape + (2,)).reshape(-1, 2)
+            agent_dir = np.broadcast_to(agent_dir, batch_shape).reshape(-1)
+
+            i, j = agent_pos.T
+            inside = (i >= 0) & (i < width) & (j >= 0) & (j < height)
+            batch = np.flatnonzero(inside)
+
+            flat_idx = idx.reshape(-1, width, height)
+            flat_idx[batch, i[batch], j[batch]] += 2 * (agent_dir[batch] + 1)
+
+        return idx
+
+    @staticmethod
+    def render_encoding(
+        array,
         tile_size,
         agent_pos=None,
         agent_dir=None,
         highlight_mask=None
     ):
         """
-        Render this grid at a given scale
-        :param r: target renderer object
-        :param tile_size: tile size in pixels
+        Render an array grid encoding, or a stack of encodings of shape
+        (..., width, height, 3) into images of shape (..., height *
+        tile_size, width * tile_size, 3) using one gather from the atlas
         """
 
-        if highlight_mask is None:
-            highlight_mask = np.zeros(shape=(self.width, self.height), dtype=np.bool)
+        idx = Grid.encoding_indices(array, agent_pos, agent_dir, highlight_mask)
 
-        # Compute the total grid size
-        width_px = self.width * tile_size
-        height_px = self.height * tile_size
+        return Grid.get_atlas(tile_size).render(idx)
 
-        img = np.zeros(shape=(height_px, width_px, 3), dtype=np.uint8)
+    @staticmethod
+    def render_obs(image, tile_size=TILE_PIXELS//2):
+        """
+        Render agent observations, or a stack of them, as seen from the
+        agent: facing up from the middle of the bottom row, with the
+        visible cells highlighted
+        """
 
-        # Render the grid
-        for j in range(0, self.height):
-            for i in range(0, self.width):
-                cell = self.get(i, j)
+        view_size = image.shape[-2]
 
-                agent_here = np.array_equal(agent_pos, (i, j))
-                tile_img = Grid.render_tile(
-                    cell,
-                    agent_dir=agent_dir if agent_here else None,
-                    highlight=highlight_mask[i, j],
-                    tile_size=tile_size
-                )
+        return Grid.render_encoding(
+            image,
+            tile_size,
+            agent_pos=(view_size // 2, view_size - 1),
+            agent_dir=3,
+            highlight_mask=image[..., 0] != OBJECT_TO_IDX['unseen']
+        )
 
-                ymin = j * tile_size
-                ymax = (j+1) * tile_size
-                xmin = i * tile_size
-                xmax = (i+1) * tile_size
-                img[ymin:ymax, xmin:xmax, :] = tile_img
+    def render(
+        self,
+        tile_size,
+        agent_pos=None,
+        agent_dir=None,
+        highlight_mask=None
+    ):
+        """
+        Render this grid at a given scale
+        :param r: target renderer object
+        :param tile_size: tile size in pixels
+        """
 
-        return img
+        idx = self.tile_indices(agent_pos, agent_dir, highlight_mask)
+
+        return Grid.get_atlas(tile_size).render(idx)
 
     def encode(self, vis_mask=None):
         """
         Produce a compact numpy encoding of the grid
         """
 
-        if vis_mask is None:
-            vis_mask = np.ones((self.width, self.height), dtype=bool)
-
-        array = np.zeros((self.width, self.height, 3), dtype='uint8')
+        array = self._array.copy()
 
-        for i in range(self.width):
-            for j in range(self.height):
-                if vis_mask[i, j]:
-                    v = self.get(i, j)
-
-                    if v is None:
-                        array[i, j, 0] = OBJECT_TO_IDX['empty']
-                        array[i, j, 1] = 0
-                        array[i, j, 2] = 0
-
-                    else:
-                        array[i, j, :] = v.encode()
+        if vis_mask is not None:
+            array[~np.asarray(vis_mask, dtype=bool)] = 0
 
         return array
 
@@ -564,57 +1086,426 @@ class Grid:
         width, height, channels = array.shape
         assert channels == 3
 
-        vis_mask = np.ones(shape=(width, height), dtype=np.bool)
+        vis_mask = array[:, :, 0] != OBJECT_TO_IDX['unseen']
 
+        # Only non-empty cells need to be instantiated
         grid = Grid(width, height)
-        for i in range(width):
-            for j in range(height):
-                type_idx, color_idx, state = array[i, j]
-                v = WorldObj.decode(type_idx, color_idx, state)
-                grid.set(i, j, v)
-                vis_mask[i, j] = (type_idx != OBJECT_TO_IDX['unseen'])
+        for i, j in zip(*np.nonzero(array[:, :, 0] > OBJECT_TO_IDX['empty'])):
+            type_idx, color_idx, state = array[i, j]
+            v = WorldObj.decode(type_idx, color_idx, state)
+            grid.set(i, j, v)
 
         return grid, vis_mask
 
-    def process_vis(grid, agent_pos):
-        mask = np.zeros(shape=(grid.width, grid.height), dtype=np.bool)
+    @staticmethod
+    def pack(array):
+        """
+        Pack an array grid encoding, or a stack of them, into one uint16
+        per cell: type | color << 4 | state << 7
+        """
 
-        mask[agent_pos[0], agent_pos[1]] = True
+        codes = array[..., 0].astype(np.uint16, order='C')
+        codes |= array[..., 1].astype(np.uint16) << PACKED_COLOR_SHIFT
+        codes |= array[..., 2].astype(np.uint16) << PACKED_STATE_SHIFT
 
-        for j in reversed(range(0, grid.height)):
-            for i in range(0, grid.width-1):
-                if not mask[i, j]:
-                    continue
+        return codes
 
-                cell = grid.get(i, j)
-                if cell and not cell.see_behind():
-                    continue
+    @staticmethod
+    def unpack(codes):
+        """
+        Unpack cells packed by Grid.pack back into an array grid encoding
+        """
 
-                mask[i+1, j] = True
-                if j > 0:
-                    mask[i+1, j-1] = True
-                    mask[i, j-1] = True
+        array = np.empty(codes.shape + (3,), dtype=np.uint8)
+        array[..., 0] = codes & ((1 << PACKED_COLOR_SHIFT) - 1)
+        array[..., 1] = (codes >> PACKED_COLOR_SHIFT) & ((1 << (PACKED_STATE_SHIFT - PACKED_COLOR_SHIFT)) - 1)
+        array[..., 2] = codes >> PACKED_STATE_SHIFT
 
-            for i in reversed(range(1, grid.width)):
-                if not mask[i, j]:
-                    continue
+        return array
 
-                cell = grid.get(i, j)
-                if cell and not cell.see_behind():
-                    continue
+    @staticmethod
+    def pack_bytes(array):
+        """
+        Pack an array grid encoding into a fixed-size uint8 array holding
+        the 9 bits of each cell back to back, or a stack of encodings into
+        one such row each. Use .tobytes() to get a byte string.
+        """
+
+        codes = Grid.pack(array)
+        codes = codes.reshape(codes.shape[:-2] + (-1, 1))
+
+        bits = (codes >> np.arange(PACKED_CELL_BITS, dtype=np.uint16)) & 1
+        bits = bits.reshape(bits.shape[:-2] + (-1,)).astype(np.uint8)
+
+        return np.packbits(bits, axis=-1)
+
+    @staticmethod
+    def unpack_bytes(data, width, height):
+        """
+        Unpack cells packed by Grid.pack_bytes back into an array grid
+        encoding of the given size, or a stack of them
+        """
+
+        if isinstance(data, (bytes, bytearray)):
+            data = np.frombuffer(data, dtype=np.uint8)
 
-                mask[i-1, j] = True
-                if j > 0:
-                    mask[i-1, j-1] = True
-                    mask[i, j-1] = True
+        num_bits = width * height * PACKED_CELL_BITS
+        bits = np.unpackbits(data, axis=-1)[..., :num_bits]
+        bits = bits.reshape(bits.shape[:-1] + (width * height, PACKED_CELL_BITS))
 
-        for j in range(0, grid.height):
-            for i in range(0, grid.width):
-                if not mask[i, j]:
-                    grid.set(i, j, None)
+        codes = bits.astype(np.uint16).dot(1 << np.arange(PACKED_CELL_BITS, dtype=np.uint16))
+
+        return Grid.unpack(codes.reshape(codes.shape[:-1] + (width, height)))
+
+    @staticmethod
+    def _vis_row(seen, see_behind, width):
+        """
+        Propagate visibility along one row of the grid. Rows are encoded as
+        integer bitmasks, with bit i standing for column i. Takes the cells
+        of the row already known to be visible and the cells that do not
+        block sight, and returns the visible cells of the row along with
+        the cells they make visible in the row above.
+
+        The same code works on numpy integer arrays holding one row per
+        element, which allows processing rows of many grids at once.
+        """
+
+        full = (1 << width) - 1
+
+        # Left to right: a transparent visible cell shows its right neighbor
+        fill = seen & see_behind
+        trans = see_behind
+        shift = 1
+        while shift < width:
+            fill = fill | (trans & (fill << shift))
+            trans = trans & (trans << shift)
+            shift *= 2
+        seen = seen | ((fill << 1) & full)
+        left = fill & (full >> 1)
+        above = left | (left << 1)
+
+        # Right to left: a transparent visible cell shows its left neighbor
+        fill = seen & see_behind
+        trans = see_behind
+        shift = 1
+        while shift < width:
+            fill = fill | (trans & (fill >> shift))
+            trans = trans & (trans >> shift)
+            shift *= 2
+        seen = seen | (fill >> 1)
+        right = fill & (full - 1)
+        above = above | right | (right >> 1)
+
+        return seen, above
+
+    @classmethod
+    def _vis_table(cls, width):
+        """
+        Get the lookup tables mapping (seen | see_behind << width) to the
+        results of _vis_row for all the possible rows of a given width,
+        along with a table unpacking each row bitmask into booleans
+        """
+
+        if width not in cls.vis_tables:
+            seen_table = []
+            above_table = []
+            for key in range(1 << (2 * width)):
+                seen, above = cls._vis_row(
+                    key & ((1 << width) - 1),
+                    key >> width,
+                    width
+                )
+                seen_table.append(seen)
+                above_table.append(above)
+            masks = np.arange(1 << width)[:, np.newaxis]
+            unpack_table = (masks & cls._vis_weights(width)) != 0
+            cls.vis_tables[width] = (seen_table, above_table, unpack_table)
+
+        return cls.vis_tables[width]
+
+    @classmethod
+    def _vis_weights(cls, width):
+        """
+        Get the weight of each cell of a row when packing it into a bitmask
+        """
+
+        if width not in cls.vis_weights:
+            bits = np.arange(width, dtype=np.int64 if width < 63 else object)
+            cls.vis_weights[width] = 1 << bits
+
+        return cls.vis_weights[width]
+
+    @classmethod
+    def vis_mask(cls, see_behind, agent_pos, out=None):
+        """
+        Compute which cells are visible from agent_pos, given a boolean array
+        telling which cells do not block the agent's sight. The mask is
+        written into out when given.
+        """
+
+        width, height = see_behind.shape
+        weights = cls._vis_weights(width)
+
+        if out is None:
+            out = np.empty((width, height), dtype=bool)
+
+        # Pack each row of the transparency plane into an integer
+        rows = see_behind.T.dot(weights).tolist()
+
+        # Visibility propagates upwards from the agent's row
+        seen = [0] * height
+        above = 1 << int(agent_pos[0])
+
+        if width in cls.vis_table_sizes:
+            seen_table, above_table, unpack_table = cls._vis_table(width)
+            for j in reversed(range(0, int(agent_pos[1]) + 1)):
+                key = above | (rows[j] << width)
+                seen[j] = seen_table[key]
+                above = above_table[key]
+
+            # Unpack the visible rows straight into the mask
+            np.take(unpack_table, seen, axis=0, out=out.T, mode='clip')
+        else:
+            for j in reversed(range(0, int(agent_pos[1]) + 1)):
+                seen[j], above = cls._vis_row(above, rows[j], width)
+
+            # Unpack the visible rows into a boolean array
+            seen = np.array(seen, dtype=weights.dtype)
+            out[...] = (seen[np.newaxis, :] & weights[:, np.newaxis]) != 0
+
+        return out
+
+    def process_vis(grid, agent_pos):
+        mask = Grid.vis_mask(grid._see_behind, agent_pos)
+
+        # Clear the cells the agent cannot see
+        hidden = ~mask
+        grid._cells()[hidden] = None
+        grid._array[hidden] = (OBJECT_TO_IDX['empty'], 0, 0)
+        grid._see_behind[hidden] = True
+        grid._hash = None
+        grid._index = None
 
         return mask
 
+class TileAtlas:
+    """
+    All the tiles Grid.render_tile can produce at a given tile size, stored
+    in one contiguous (num_tiles, tile_size, tile_size, 3) array. Tiles are
+    indexed by the (type, color, state) encoding of the cell, the direction
+    of the agent standing on it (-1 when there is none) and whether the
+    cell is highlighted. Atlases can be saved and loaded, in which case
+    .npy files are memory-mapped read-only so that processes loading the
+    same atlas share it.
+    """
+
+    # Size of each index dimension: type, color, state, agent_dir + 1 and
+    # highlight
+    dims = (len(OBJECT_TO_IDX), len(COLOR_TO_IDX), 3, 5, 2)
+
+    def __init__(self, tiles, filled=None):
+        num_tiles = int(np.prod(TileAtlas.dims))
+        assert tiles.ndim == 4 and tiles.shape[0] == num_tiles, tiles.shape
+        assert tiles.shape[1] == tiles.shape[2] and tiles.shape[3] == 3
+
+        self.tiles = tiles
+        self.tile_size = tiles.shape[1]
+
+        # Tiles which have been drawn, all of them unless specified
+        if filled is None:
+            filled = np.ones(num_tiles, dtype=bool)
+        self.filled = filled
+
+    @classmethod
+    def empty(cls, tile_size=TILE_PIXELS):
+        """
+        Create an atlas whose tiles are drawn on demand by fill
+        """
+
+        num_tiles = int(np.prod(cls.dims))
+        tiles = np.zeros((num_tiles, tile_size, tile_size, 3), dtype=np.uint8)
+
+        return cls(tiles, np.zeros(num_tiles, dtype=bool))
+
+    @classmethod
+    def build(cls, tile_size=TILE_PIXELS):
+        """
+        Render every tile for a given tile size
+        """
+
+        atlas = cls.empty(tile_size)
+        atlas.fill(np.arange(len(atlas.tiles)))
+
+        return atlas
+
+    def fill(self, idx):
+        """
+        Draw the tiles at the given indices which have not been drawn yet
+        """
+
+        missing = idx[~self.filled[idx]]
+        if len(missing) == 0:
+            return
+
+        # Encodings which decode to the same object share their tiles
+        drawn = {}
+
+        for tile_idx in np.unique(missing):
+            type_idx, color_idx, state, dir_idx, highlight = np.unravel_index(tile_idx, self.dims)
+            if type_idx == OBJECT_TO_IDX['agent']:
+                obj = None
+            else:
+                obj = WorldObj.decode(type_idx, color_idx, state)
+            agent_dir = int(dir_idx) - 1 if dir_idx > 0 else None
+
+            key = (obj.encode() if obj else None, agent_dir, highlight)
+            if key not in drawn:
+                drawn[key] = Grid.draw_tile(obj, agent_dir, bool(highlight), self.tile_size)
+
+            self.tiles[tile_idx] = drawn[key]
+            self.filled[tile_idx] = True
+
+    @classmethod
+    def index(cls, type_idx, color_idx, state, agent_dir=-1, highlight=False):
+        """
+        Get the index of a tile in the atlas. This works on integers as
+        well as on arrays, agent_dir being -1 where there is no agent.
+        """
+
+        _, num_colors, num_states, num_dirs, _ = cls.dims
+
+        idx = np.asarray(type_idx, dtype=np.intp) * num_colors + color_idx
+        idx = idx * num_states + state
+        idx = idx * num_dirs + agent_dir + 1
+        idx = idx * 2 + highlight
+
+        return idx
+
+    def tile(self, obj, agent_dir=None, highlight=False):
+        """
+        Get the tile of an object, or None for an empty cell
+        """
+
+        if obj is None:
+            type_idx, color_idx, state = OBJECT_TO_IDX['empty'], 0, 0
+        else:
+            type_idx, color_idx, state = obj.encode()
+
+        idx = self.index(
+            type_idx,
+            color_idx,
+            state,
+            -1 if agent_dir is None else agent_dir,
+            int(highlight)
+        )
+        self.fill(idx.reshape(1))
+
+        return self.tiles[idx]
+
+    def render(self, idx):
+        """
+        Assemble a frame from a (width, height) array of tile indices, or
+        frames from a stack of such arrays
+        """
+
+        width, height = idx.shape[-2:]
+        self.fill(idx.ravel())
+
+        # Gather the tiles in row-major order, then interleave the tile
+        # rows with the grid rows
+        img = self.tiles[np.swapaxes(idx, -1, -2)]
+        img = np.swapaxes(img, -4, -3)
+
+        return img.reshape(idx.shape[:-2] + (height * self.tile_size, width * self.tile_size, 3))
+
+    def save(self, path):
+        """
+        Save the atlas, compressed if path ends with .npz. Tiles which have
+        not been drawn yet are drawn first.
+        """
+
+        self.fill(np.arange(len(self.tiles)))
+
+        if path.endswith('.npz'):
+            np.savez_compressed(path, tiles=self.tiles)
+        else:
+            np.save(path, self.tiles)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load an atlas, memory-mapped read-only if it is a .npy file and
+        mmap is set
+        """
+
+        if path.endswith('.npz'):
+            with np.load(path) as data:
+                tiles = data['tiles']
+        else:
+            tiles = np.load(path, mmap_mode='r' if mmap else None)
+
+        return cls(tiles)
+
+# Atlas index of the tile of every (type, color, state) encoding, without
+# agent and not highlighted
+TileAtlas.cell_indices = TileAtlas.index(*np.indices(TileAtlas.dims[:3]))
+
+class FrameRenderer:
+    """
+    Renders consecutive frames of a grid at a given tile size, keeping the
+    previous frame along with the atlas indices of its tiles so that only
+    the tiles whose index changed get redrawn. Between two steps, this is
+    usually the agent's old and new cells and the edges of its view.
+    """
+
+    def __init__(self, tile_size=TILE_PIXELS):
+        self.tile_size = tile_size
+        self.frame = None
+        self.indices = None
+
+    def render(self, idx):
+        """
+        Render a frame from a (width, height) array of tile indices. The
+        frame returned is updated in place by the next call.
+        """
+
+        atlas = Grid.get_atlas(self.tile_size)
+
+        if self.indices is None or self.indices.shape != idx.shape:
+            self.frame = atlas.render(idx)
+            self.indices = idx.copy()
+            return self.frame
+
+        xs, ys = np.nonzero(idx != self.indices)
+
+        if len(xs) > 0:
+            changed = idx[xs, ys]
+            atlas.fill(changed)
+
+            # View the frame as (height, tile_size, width, tile_size, 3)
+            width, height = idx.shape
+            ts = self.tile_size
+            tiles = self.frame.reshape(height, ts, width, ts, 3)
+            tiles[ys, :, xs] = atlas.tiles[changed]
+
+            self.indices[xs, ys] = changed
+
+        return self.frame
+
+# Snapshot of the state of an environment, see MiniGridEnv.get_state
+EnvState = namedtuple('EnvState', [
+    'grid',
+    'encoding',
+    'see_behind',
+    'cells',
+    'agent_pos',
+    'agent_dir',
+    'carrying',
+    'step_count',
+    'mission',
+    'extra'
+])
+
 class MiniGridEnv(gym.Env):
     """
     2D grid world game environment
@@ -642,6 +1533,36 @@ class MiniGridEnv(gym.Env):
         # Done completing task
         done = 6
 
+    # Set to True to check that hash values are never shared by different
+    # states. This keeps every hashed state in memory, for testing only.
+    check_hash_collisions = False
+    _hash_states = None
+
+    # State of the agent before each journaled step, see enable_undo
+    _undo_frames = None
+
+    # Observation dictionary which step and reset write into, instead of
+    # allocating a new observation. A previous observation can be used. The
+    # observations returned are then this same dictionary and image array,
+    # which the next call to step or reset overwrites: copy what you keep.
+    obs_buffer = None
+
+    # Arrays reused by gen_obs_image for the agent's view window, its
+    # transparency and the visibility mask, along with the views of the
+    # window rotated for each direction. Reallocated when the view size
+    # changes.
+    _view_scratch = None
+
+    # Set to True to have render return the same frame array every time,
+    # which is updated in place by redrawing only the tiles which changed.
+    # The next call to render overwrites it: copy what you keep.
+    reuse_frames = False
+
+    # Names of the attributes, besides the grid and the agent, making up the
+    # state of an episode. These are saved and restored by get_state and
+    # set_state, subclasses extend this with their own episode variables.
+    state_attrs = ()
+
     def __init__(
         self,
         grid_size=None,
@@ -687,6 +1608,9 @@ class MiniGridEnv(gym.Env):
         # Window to use for human rendering mode
         self.window = None
 
+        # Renderers keeping the previous frame, indexed by tile size
+        self._frame_renderers = {}
+
         # Environment configuration
         self.width = width
         self.height = height
@@ -717,6 +1641,10 @@ class MiniGridEnv(gym.Env):
         assert self.agent_pos is not None
         assert self.agent_dir is not None
 
+        # Steps of the previous episode can no longer be undone
+        if self._undo_frames is not None:
+            self._clear_undo()
+
         # Check that the agent doesn't overlap with an object
         start_cell = self.grid.get(*self.agent_pos)
         assert start_cell is None or start_cell.can_overlap()
@@ -736,17 +1664,213 @@ class MiniGridEnv(gym.Env):
         self.np_random, _ = seeding.np_random(seed)
         return [seed]
 
+    def zobrist_hash(self):
+        """
+        64-bit Zobrist hash of the current state of the environment, as an
+        integer. This combines the incrementally maintained hash of the grid
+        with keys for the agent position, direction and carried object, and
+        runs in constant time.
+        """
+
+        _, agent_keys, dir_keys, carrying_keys = Grid._zobrist_keys(
+            self.grid.width,
+            self.grid.height
+        )
+
+        x, y = self.agent_pos
+        state_hash = self.grid.zobrist_hash()
+        state_hash ^= int(agent_keys[int(y) * self.grid.width + int(x)])
+        state_hash ^= int(dir_keys[self.agent_dir])
+        if self.carrying is not None:
+            state_hash ^= int(carrying_keys[self.carrying.encode()])
+
+        if self.check_hash_collisions:
+            self._check_hash_collision(state_hash)
+
+        return state_hash
+
+    def _check_hash_collision(self, state_hash):
+        """
+        Verify that a hash value is never produced by two different states
+        """
+
+        carrying = self.carrying.encode() if self.carrying else None
+        state = (
+            self.grid.encoding.tobytes(),
+            tuple(int(v) for v in self.agent_pos),
+            int(self.agent_dir),
+            carrying
+        )
+
+        if self._hash_states is None:
+            self._hash_states = {}
+        prev_state = self._hash_states.setdefault(state_hash, state)
+        assert prev_state == state, 'hash collision on {:016x}'.format(state_hash)
+
     def hash(self, size=16):
         """Compute a hash that uniquely identifies the current state of the environment.
-        :param size: Size of the hashing
+        :param size: Size of the hashing, in hexadecimal digits (at most 16)
+        """
+
+        return '{:016x}'.format(self.zobrist_hash())[:size]
+
+    def get_state(self):
+        """
+        Capture the current state of the environment into an immutable
+        snapshot, which set_state can restore any number of times. The
+        random number generator is not part of the state.
+        """
+
+        grid = self.grid
+
+        def frozen(array):
+            array.flags.writeable = False
+            return array
+
+        carrying = None
+        if self.carrying is not None:
+            carrying = (self.carrying, self.carrying.encode(), self.carrying.cur_pos)
+
+        extra = tuple(
+            (name, MiniGridEnv._copy_state_attr(getattr(self, name)))
+            for name in self.state_attrs
+        )
+
+        return EnvState(
+            grid=grid,
+            encoding=frozen(grid._array.copy()),
+            see_behind=frozen(grid._see_behind.copy()),
+            cells=frozen(grid.grid.copy()),
+            agent_pos=tuple(int(v) for v in self.agent_pos),
+            agent_dir=int(self.agent_dir),
+            carrying=carrying,
+            step_count=self.step_count,
+            mission=self.mission,
+            extra=extra
+        )
+
+    @staticmethod
+    def _copy_state_attr(value):
+        """
+        Copy the containers held by state attributes, such as lists of
+        obstacles. Objects are kept as they are, since they are the ones
+        in the grid and their state is restored from the cells.
+        """
+
+        if isinstance(value, (list, dict, set, np.ndarray)):
+            return copy.copy(value)
+
+        return value
+
+    def set_state(self, state):
         """
-        sample_hash = hashlib.sha256()
+        Restore a snapshot produced by get_state. Only the objects of the
+        cells which differ from the snapshot are updated.
+        """
+
+        grid = state.grid
+
+        # Find the cells whose object or encoding changed
+        if grid is self.grid:
+            changed = grid.grid != state.cells
+            changed |= (grid._array != state.encoding).any(axis=2).T.reshape(-1)
+            changed = np.flatnonzero(changed)
+        else:
+            changed = range(grid.width * grid.height)
+            self.grid = grid
+
+        for idx in changed:
+            i, j = idx % grid.width, idx // grid.width
+
+            # Objects which track their position are moved back to the cell
+            v = state.cells[idx]
+            cur_pos = (i, j) if v is not None and v.cur_pos is not None else None
+
+            grid._restore_cell(
+                i,
+                j,
+                v,
+                cur_pos,
+                state.encoding[i, j],
+                state.see_behind[i, j]
+            )
+
+        if state.carrying is None:
+            self.carrying = None
+        else:
+            self.carrying, encoding, self.carrying.cur_pos = state.carrying
+            self.carrying._grid = None
+            self.carrying._apply_encoding(*encoding[1:])
+
+        self.agent_pos = state.agent_pos
+        self.agent_dir = state.agent_dir
+        self.step_count = state.step_count
+        self.mission = state.mission
 
-        to_encode = [self.grid.encode().tolist(), self.agent_pos, self.agent_dir]
-        for item in to_encode:
-            sample_hash.update(str(item).encode('utf8'))
+        for name, value in state.extra:
+            setattr(self, name, MiniGridEnv._copy_state_attr(value))
+
+        # The journaled steps do not lead to the restored state
+        if self._undo_frames is not None:
+            self._clear_undo()
+
+    def enable_undo(self):
+        """
+        Start journaling the changes made by each step, so that undo() can
+        revert them in time proportional to the number of cells changed.
+        The step method of the environment, including overrides made by
+        subclasses, is wrapped to record the state of the agent first.
+        """
+
+        if self._undo_frames is None:
+            self.step = self._journaled_step
+            self._clear_undo()
+
+    def disable_undo(self):
+        """
+        Stop journaling steps and discard the ones recorded
+        """
 
-        return sample_hash.hexdigest()[:size]
+        if self._undo_frames is not None:
+            del self.step
+            self._undo_frames = None
+            self.grid._journal = None
+
+    def _clear_undo(self):
+        self._undo_frames = []
+        self.grid._journal = []
+
+    def _journaled_step(self, action):
+        carrying_pos = self.carrying.cur_pos if self.carrying else None
+        self._undo_frames.append((
+            self.grid,
+            len(self.grid._journal),
+            self.agent_pos,
+            self.agent_dir,
+            self.carrying,
+            carrying_pos,
+            self.step_count
+        ))
+
+        return type(self).step(self, action)
+
+    def undo(self):
+        """
+        Revert the last journaled step
+        """
+
+        assert self._undo_frames, 'no step to undo'
+
+        frame = self._undo_frames.pop()
+        grid, length, self.agent_pos, self.agent_dir, carrying, carrying_pos, self.step_count = frame
+        assert grid is self.grid
+
+        grid._rewind(length)
+
+        self.carrying = carrying
+        if carrying is not None:
+            carrying._grid = None
+            carrying.cur_pos = carrying_pos
 
     @property
     def steps_remaining(self):
@@ -910,31 +2034,35 @@ class MiniGridEnv(gym.Env):
         if size is None:
             size = (self.grid.width, self.grid.height)
 
+        # Don't place the object on top of another object
+        xs, ys = self.grid.free_cells(top, size)
+
+        num_candidates = len(xs)
         num_tries = 0
 
         while True:
-            # This is to handle with rare cases where rejection sampling
-            # gets stuck in an infinite loop
+            if num_candidates == 0:
+                raise RecursionError('no free position in place_obj')
+
+            # This is to handle with rare cases where the filtering
+            # criterion rejects most positions
             if num_tries > max_tries:
                 raise RecursionError('rejection sampling failed in place_obj')
 
             num_tries += 1
 
-            pos = np.array((
-                self._rand_int(top[0], min(top[0] + size[0], self.grid.width)),
-                self._rand_int(top[1], min(top[1] + size[1], self.grid.height))
-            ))
-
-            # Don't place the object on top of another object
-            if self.grid.get(*pos) != None:
-                continue
-
-            # Don't place the object where the agent is
-            if np.array_equal(pos, self.agent_pos):
-                continue
-
-            # Check if there is a filtering criterion
-            if reject_fn and reject_fn(self, pos):
+            idx = self._rand_int(0, num_candidates)
+            pos = np.array((xs[idx], ys[idx]))
+
+            # Don't place the object where the agent is, and check if there
+            # is a filtering criterion. Rejected positions are removed from
+            # the candidates, so that sampling remains uniform over the
+            # accepted ones.
+            if (self.agent_pos is not None and tuple(pos) == tuple(self.agent_pos)) or \
+               (reject_fn and reject_fn(self, pos)):
+                num_candidates -= 1
+                xs[idx] = xs[num_candidates]
+                ys[idx] = ys[num_candidates]
                 continue
 
             break
@@ -992,8 +2120,8 @@ class MiniGridEnv(gym.Env):
         Get the vector pointing to the right of the agent.
         """
 
-        dx, dy = self.dir_vec
-        return np.array((-dy, dx))
+        assert self.agent_dir >= 0 and self.agent_dir < 4
+        return DIR_TO_RIGHT_VEC[self.agent_dir]
 
     @property
     def front_pos(self):
@@ -1089,8 +2217,8 @@ class MiniGridEnv(gym.Env):
             return False
         vx, vy = coordinates
 
-        obs = self.gen_obs()
-        obs_grid, _ = Grid.decode(obs['image'])
+        image, _ = self.gen_obs_image()
+        obs_grid, _ = Grid.decode(image)
         obs_cell = obs_grid.get(vx, vy)
         world_cell = self.grid.get(x, y)
 
@@ -1133,8 +2261,8 @@ class MiniGridEnv(gym.Env):
             if fwd_cell and fwd_cell.can_pickup():
                 if self.carrying is None:
                     self.carrying = fwd_cell
-                    self.carrying.cur_pos = np.array([-1, -1])
                     self.grid.set(*fwd_pos, None)
+                    self.carrying.cur_pos = np.array([-1, -1])
 
         # Drop an object
         elif action == self.actions.drop:
@@ -1177,7 +2305,6 @@ class MiniGridEnv(gym.Env):
             grid = grid.rotate_left()
 
         # Process occluders and visibility
-        # Note that this incurs some performance cost
         if not self.see_through_walls:
             vis_mask = grid.process_vis(agent_pos=(self.agent_view_size // 2 , self.agent_view_size - 1))
         else:
@@ -1194,15 +2321,83 @@ class MiniGridEnv(gym.Env):
 
         return grid, vis_mask
 
-    def gen_obs(self):
+    def gen_obs_image(self, out=None):
+        """
+        Generate the encoding of the sub-grid observed by the agent, along
+        with the visibility mask. This gives the same result as encoding
+        the output of gen_obs_grid, but works directly on the grid arrays.
+        The encoding is written into out when given, which must be a uint8
+        array of shape (agent_view_size, agent_view_size, 3), and the mask
+        returned is then overwritten by the next call.
+        """
+
+        size = self.agent_view_size
+        scratch = self._view_scratch
+        # Copies of the environment get separate arrays for the rotated
+        # views, which must be recreated
+        if scratch is None or scratch[0].shape[0] != size or scratch[3][0].base is not scratch[0]:
+            array = np.empty((size, size, 3), dtype=np.uint8)
+            see_behind = np.empty((size, size), dtype=bool)
+            scratch = (
+                array,
+                see_behind,
+                # Transposed so that vis_mask can write rows contiguously
+                np.empty((size, size), dtype=bool).T,
+                # Rotations making the agent face up, for each direction
+                [np.rot90(array, k=-(d + 1)) for d in range(4)],
+                [np.rot90(see_behind, k=-(d + 1)) for d in range(4)]
+            )
+            self._view_scratch = scratch
+        array, see_behind, vis_mask, rotated, rotated_see_behind = scratch
+
+        topX, topY, botX, botY = self.get_view_exts()
+        self.grid.slice_arrays(topX, topY, size, size, out=(array, see_behind))
+
+        allocate = out is None
+        if allocate:
+            out = np.empty(array.shape, dtype=np.uint8)
+
+        # Rotate the view so that the agent is facing up
+        np.copyto(out, rotated[self.agent_dir])
+        see_behind = rotated_see_behind[self.agent_dir]
+
+        agent_pos = self.agent_view_size // 2, self.agent_view_size - 1
+
+        # Process occluders and visibility
+        if not self.see_through_walls:
+            Grid.vis_mask(see_behind, agent_pos, out=vis_mask)
+        else:
+            vis_mask[...] = True
+
+        # Make it so the agent sees what it's carrying
+        if self.carrying:
+            out[agent_pos] = self.carrying.encode()
+        else:
+            out[agent_pos] = (OBJECT_TO_IDX['empty'], 0, 0)
+
+        if not self.see_through_walls:
+            out *= vis_mask[:, :, np.newaxis]
+
+        # Callers not writing into their own buffer get their own mask
+        if allocate:
+            vis_mask = vis_mask.copy()
+
+        return out, vis_mask
+
+    def gen_obs(self, out=None):
         """
         Generate the agent's view (partially observable, low-resolution encoding)
+
+        When out is given, or else when obs_buffer is set, the observation
+        is written into that dictionary, including its 'image' array, which
+        is returned instead of a new observation.
         """
 
-        grid, vis_mask = self.gen_obs_grid()
+        if out is None:
+            out = self.obs_buffer
 
         # Encode the partially observable view into a numpy array
-        image = grid.encode(vis_mask)
+        image, vis_mask = self.gen_obs_image(out['image'] if out else None)
 
         assert hasattr(self, 'mission'), "environments must define a textual mission string"
 
@@ -1210,30 +2405,44 @@ class MiniGridEnv(gym.Env):
         # - an image (partially observable view of the environment)
         # - the agent's direction/orientation (acting as a compass)
         # - a textual mission string (instructions for the agent)
-        obs = {
-            'image': image,
-            'direction': self.agent_dir,
-            'mission': self.mission
-        }
+        if out is None:
+            out = {}
+        out['image'] = image
+        out['direction'] = self.agent_dir
+        out['mission'] = self.mission
 
-        return obs
+        return out
 
-    def get_obs_render(self, obs, tile_size=TILE_PIXELS//2):
+    def get_highlight_mask(self):
         """
-        Render an agent observation for visualization
+        Get the (width, height) mask of the cells of the grid which are
+        visible to the agent
         """
 
-        grid, vis_mask = Grid.decode(obs)
+        _, vis_mask = self.gen_obs_image()
 
-        # Render the whole grid
-        img = grid.render(
-            tile_size,
-            agent_pos=(self.agent_view_size // 2, self.agent_view_size - 1),
-            agent_dir=3,
-            highlight_mask=vis_mask
-        )
+        # World coordinates of the visible cells of the agent's view, the
+        # top-left corner of the view being the furthest cell on its left
+        vis_i, vis_j = np.nonzero(vis_mask)
+        top_left = self.agent_pos + self.dir_vec * (self.agent_view_size-1) - self.right_vec * (self.agent_view_size // 2)
+        abs_i = top_left[0] - self.dir_vec[0] * vis_j + self.right_vec[0] * vis_i
+        abs_j = top_left[1] - self.dir_vec[1] * vis_j + self.right_vec[1] * vis_i
 
-        return img
+        inside = (abs_i >= 0) & (abs_i < self.width) & (abs_j >= 0) & (abs_j < self.height)
+
+        highlight_mask = np.zeros(shape=(self.width, self.height), dtype=bool)
+        highlight_mask[abs_i[inside], abs_j[inside]] = True
+
+        return highlight_mask
+
+    def get_obs_render(self, obs, tile_size=TILE_PIXELS//2):
+        """
+        Render an agent observation for visualization
+        """
+
+        # Go straight from the encoding to the atlas tiles, unseen cells
+        # being drawn as empty ones
+        return Grid.render_obs(obs, tile_size)
 
     def render(self, mode='human', close=False, highlight=True, tile_size=TILE_PIXELS):
         """
@@ -1250,43 +2459,20 @@ class MiniGridEnv(gym.Env):
             self.window = gym_minigrid.window.Window('gym_minigrid')
             self.window.show(block=False)
 
-        # Compute which cells are visible to the agent
-        _, vis_mask = self.gen_obs_grid()
-
-        # Compute the world coordinates of the bottom-left corner
-        # of the agent's view area
-        f_vec = self.dir_vec
-        r_vec = self.right_vec
-        top_left = self.agent_pos + f_vec * (self.agent_view_size-1) - r_vec * (self.agent_view_size // 2)
-
-        # Mask of which cells to highlight
-        highlight_mask = np.zeros(shape=(self.width, self.height), dtype=np.bool)
-
-        # For each cell in the visibility mask
-        for vis_j in range(0, self.agent_view_size):
-            for vis_i in range(0, self.agent_view_size):
-                # If this cell is not visible, don't highlight it
-                if not vis_mask[vis_i, vis_j]:
-                    continue
+        # Render the whole grid, redrawing only the tiles which changed
+        # since the previous frame of this size
+        if tile_size not in self._frame_renderers:
+            self._frame_renderers[tile_size] = FrameRenderer(tile_size)
 
-                # Compute the world coordinates of this cell
-                abs_i, abs_j = top_left - (f_vec * vis_j) + (r_vec * vis_i)
-
-                if abs_i < 0 or abs_i >= self.width:
-                    continue
-                if abs_j < 0 or abs_j >= self.height:
-                    continue
-
-                # Mark this cell to be highlighted
-                highlight_mask[abs_i, abs_j] = True
-
-        # Render the whole grid
-        img = self.grid.render(
-            tile_size,
+        idx = self.grid.tile_indices(
             self.agent_pos,
             self.agent_dir,
-            highlight_mask=highlight_mask if highlight else None
+            highlight_mask=self.get_highlight_mask() if highlight else None
         )
+        img = self._frame_renderers[tile_size].render(idx)
+
+        if not self.reuse_frames:
+            img = img.copy()
 
         if mode == 'human':
             self.window.set_caption(self.mission)
@@ -15,17 +15,35 @@ def downsample(img, factor):
 
     return img
 
+# Cache of pixel center coordinates, indexed by image height and width
+coords_cache = {}
+
+def pixel_coords(height, width):
+    """
+    Get the coordinates of the pixel centers of an image, normalized to
+    [0, 1], as two read-only (height, width) arrays of x and y values
+    """
+
+    key = (height, width)
+    if key not in coords_cache:
+        yf = (np.arange(height) + 0.5) / height
+        xf = (np.arange(width) + 0.5) / width
+        xs, ys = np.meshgrid(xf, yf)
+        xs.flags.writeable = False
+        ys.flags.writeable = False
+        coords_cache[key] = (xs, ys)
+
+    return coords_cache[key]
+
 def fill_coords(img, fn, color):
     """
-    Fill pixels of an image with coordinates matching a filter function
+    Fill pixels of an image with coordinates matching a filter function.
+    The function is evaluated on the coordinates of all the pixels at once
+    and returns a boolean mask.
     """
 
-    for y in range(img.shape[0]):
-        for x in range(img.shape[1]):
-            yf = (y + 0.5) / img.shape[0]
-            xf = (x + 0.5) / img.shape[1]
-            if fn(xf, yf):
-                img[y, x] = color
+    xs, ys = pixel_coords(img.shape[0], img.shape[1])
+    img[fn(xs, ys)] = color
 
     return img
 
@@ -54,20 +72,20 @@ def point_in_line(x0, y0, x1, y1, r):
     ymax = max(y0, y1) + r
 
     def fn(x, y):
-        # Fast, early escape test
-        if x < xmin or x > xmax or y < ymin or y > ymax:
-            return False
+        # Bounding box test
+        in_box = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
 
-        q = np.array([x, y])
-        pq = q - p0
+        pqx = x - p0[0]
+        pqy = y - p0[1]
 
         # Closest point on line
-        a = np.dot(pq, dir)
+        a = pqx * dir[0] + pqy * dir[1]
         a = np.clip(a, 0, dist)
-        p = p0 + a * dir
+        px = p0[0] + a * dir[0]
+        py = p0[1] + a * dir[1]
 
-        dist_to_line = np.linalg.norm(q - p)
-        return dist_to_line <= r
+        dist_to_line = np.sqrt((x - px) * (x - px) + (y - py) * (y - py))
+        return in_box & (dist_to_line <= r)
 
     return fn
 
@@ -78,7 +96,7 @@ def point_in_circle(cx, cy, r):
 
 def point_in_rect(xmin, xmax, ymin, ymax):
     def fn(x, y):
-        return x >= xmin and x <= xmax and y >= ymin and y <= ymax
+        return (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
     return fn
 
 def point_in_triangle(a, b, c):
@@ -86,17 +104,19 @@ def point_in_triangle(a, b, c):
     b = np.array(b)
     c = np.array(c)
 
+    v0 = c - a
+    v1 = b - a
+
     def fn(x, y):
-        v0 = c - a
-        v1 = b - a
-        v2 = np.array((x, y)) - a
+        v2x = x - a[0]
+        v2y = y - a[1]
 
         # Compute dot products
         dot00 = np.dot(v0, v0)
         dot01 = np.dot(v0, v1)
-        dot02 = np.dot(v0, v2)
+        dot02 = v0[0] * v2x + v0[1] * v2y
         dot11 = np.dot(v1, v1)
-        dot12 = np.dot(v1, v2)
+        dot12 = v1[0] * v2x + v1[1] * v2y
 
         # Compute barycentric coordinates
         inv_denom = 1 / (dot00 * dot11 - dot01 * dot01)
@@ -104,7 +124,7 @@ def point_in_triangle(a, b, c):
         v = (dot00 * dot12 - dot01 * dot02) * inv_denom
 
         # Check if point is in triangle
-        return (u >= 0) and (v >= 0) and (u + v) < 1
+        return (u >= 0) & (v >= 0) & ((u + v) < 1)
 
     return fn
 
@@ -0,0 +1,277 @@
+import numpy as np
+import gym
+
+from .minigrid import MiniGridEnv, Grid, WorldObj, OBJECT_TO_IDX, COLOR_TO_IDX, DIR_TO_VEC, TILE_PIXELS
+from .envs import EmptyEnv, FourRoomsEnv, DoorKeyEnv, LavaGapEnv, CrossingEnv, DistShiftEnv
+
+# Environment families whose dynamics are entirely described by the grid
+# encoding and the default MiniGridEnv.step
+SUPPORTED_ENVS = (
+    EmptyEnv,
+    FourRoomsEnv,
+    DoorKeyEnv,
+    LavaGapEnv,
+    CrossingEnv,
+    DistShiftEnv,
+)
+
+EMPTY = OBJECT_TO_IDX['empty']
+
+def _cell_properties():
+    """
+    Build lookup tables giving the properties of the object encoded by
+    each (type, state) pair, as defined by the WorldObj classes
+    """
+
+    num_types = len(OBJECT_TO_IDX)
+    see_behind = np.ones((num_types, 3), dtype=bool)
+    can_overlap = np.ones((num_types, 3), dtype=bool)
+    can_pickup = np.zeros((num_types, 3), dtype=bool)
+
+    for type_idx in range(num_types):
+        if type_idx == OBJECT_TO_IDX['agent']:
+            continue
+        for state in range(3):
+            v = WorldObj.decode(type_idx, 0, state)
+            if v is None:
+                continue
+            see_behind[type_idx, state] = v.see_behind()
+            can_overlap[type_idx, state] = v.can_overlap()
+            can_pickup[type_idx, state] = v.can_pickup()
+
+    return see_behind, can_overlap, can_pickup
+
+SEE_BEHIND, CAN_OVERLAP, CAN_PICKUP = _cell_properties()
+
+class MiniGridVecEnv:
+    """
+    Batch of MiniGrid environments stepped together with numpy operations.
+
+    All the environments of the batch come from the same family and have
+    the same grid size. New layouts are generated by a template environment,
+    after which the grids only live in a stacked (num_envs, width, height, 3)
+    encoding. Environments are reset automatically when their episode ends,
+    in which case the observation returned is the first one of the new
+    episode.
+    """
+
+    def __init__(self, env, num_envs):
+        if isinstance(env, str):
+            env = gym.make(env)
+        env = env.unwrapped
+
+        if not isinstance(env, SUPPORTED_ENVS):
+            raise ValueError(
+                '{} is not supported by MiniGridVecEnv'.format(type(env).__name__)
+            )
+
+        # Template environment used to generate new layouts
+        self.env = env
+
+        self.num_envs = num_envs
+        self.width = env.width
+        self.height = env.height
+        self.max_steps = env.max_steps
+        self.see_through_walls = env.see_through_walls
+        self.agent_view_size = env.agent_view_size
+
+        self.actions = env.actions
+        self.action_space = env.action_space
+        self.observation_space = env.observation_space
+        self.reward_range = env.reward_range
+
+        # Grids are padded with walls so that views never go out of bounds
+        pad = self.agent_view_size
+        self._pad = pad
+        self._grids = np.empty(
+            (num_envs, self.width + 2 * pad, self.height + 2 * pad, 3),
+            dtype=np.uint8
+        )
+        self._grids[:] = (OBJECT_TO_IDX['wall'], COLOR_TO_IDX['grey'], 0)
+        self.grids = self._grids[:, pad:pad+self.width, pad:pad+self.height]
+
+        # Agent state, the carried object is stored by its encoding
+        self.agent_pos = np.zeros((num_envs, 2), dtype=np.int64)
+        self.agent_dir = np.zeros(num_envs, dtype=np.int64)
+        self.carrying = np.zeros((num_envs, 3), dtype=np.uint8)
+        self.step_count = np.zeros(num_envs, dtype=np.int64)
+        self.missions = [None] * num_envs
+
+        # Visibility lookup tables as arrays, to index them with a batch
+        if self.agent_view_size in Grid.vis_table_sizes:
+            seen_table, above_table, _ = Grid._vis_table(self.agent_view_size)
+            self._vis_tables = (np.array(seen_table), np.array(above_table))
+        else:
+            self._vis_tables = None
+
+    def seed(self, seed=1337):
+        return self.env.seed(seed)
+
+    def _reset_env(self, n):
+        """
+        Generate a new layout for environment n of the batch
+        """
+
+        env = self.env
+        env.reset()
+
+        self.grids[n] = env.grid.encoding
+        self.agent_pos[n] = env.agent_pos
+        self.agent_dir[n] = env.agent_dir
+        self.carrying[n] = (EMPTY, 0, 0)
+        self.step_count[n] = 0
+        self.missions[n] = env.mission
+
+    def reset(self):
+        for n in range(self.num_envs):
+            self._reset_env(n)
+
+        return self.gen_obs()
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        batch = np.arange(self.num_envs)
+
+        self.step_count += 1
+
+        rewards = np.zeros(self.num_envs)
+        dones = np.zeros(self.num_envs, dtype=bool)
+
+        # Get the contents of the cell in front of each agent
+        fwd_pos = self.agent_pos + np.array(DIR_TO_VEC)[self.agent_dir]
+        fwd_x = fwd_pos[:, 0] + self._pad
+        fwd_y = fwd_pos[:, 1] + self._pad
+        fwd_cell = self._grids[batch, fwd_x, fwd_y]
+        fwd_type, fwd_color, fwd_state = fwd_cell.T
+
+        # Rotate left or right
+        turn = (actions == self.actions.right).astype(np.int64)
+        turn -= actions == self.actions.left
+        self.agent_dir = (self.agent_dir + turn) % 4
+
+        # Move forward
+        forward = actions == self.actions.forward
+        move = forward & CAN_OVERLAP[fwd_type, fwd_state]
+        self.agent_pos[move] = fwd_pos[move]
+        goal = forward & (fwd_type == OBJECT_TO_IDX['goal'])
+        rewards[goal] = 1 - 0.9 * (self.step_count[goal] / self.max_steps)
+        dones |= goal
+        dones |= forward & (fwd_type == OBJECT_TO_IDX['lava'])
+
+        # Pick up an object
+        empty_handed = self.carrying[:, 0] == EMPTY
+        pickup = actions == self.actions.pickup
+        pickup &= CAN_PICKUP[fwd_type, fwd_state] & empty_handed
+        self.carrying[pickup] = fwd_cell[pickup]
+        self._grids[batch[pickup], fwd_x[pickup], fwd_y[pickup]] = (EMPTY, 0, 0)
+
+        # Drop an object
+        drop = actions == self.actions.drop
+        drop &= (fwd_type == EMPTY) & ~empty_handed
+        self._grids[batch[drop], fwd_x[drop], fwd_y[drop]] = self.carrying[drop]
+        self.carrying[drop] = (EMPTY, 0, 0)
+
+        # Toggle doors, locked doors open with a key of the same color
+        toggle = actions == self.actions.toggle
+        door = toggle & (fwd_type == OBJECT_TO_IDX['door'])
+        locked = fwd_state == 2
+        has_key = (self.carrying[:, 0] == OBJECT_TO_IDX['key'])
+        has_key &= self.carrying[:, 1] == fwd_color
+        state = fwd_state.copy()
+        state[door & ~locked] = 1 - fwd_state[door & ~locked]
+        state[door & locked & has_key] = 0
+        self._grids[batch[door], fwd_x[door], fwd_y[door], 2] = state[door]
+
+        # Toggling an empty box removes it
+        box = toggle & (fwd_type == OBJECT_TO_IDX['box'])
+        self._grids[batch[box], fwd_x[box], fwd_y[box]] = (EMPTY, 0, 0)
+
+        dones |= self.step_count >= self.max_steps
+
+        for n in np.flatnonzero(dones):
+            self._reset_env(n)
+
+        obs = self.gen_obs()
+
+        return obs, rewards, dones, [{} for _ in range(self.num_envs)]
+
+    def gen_obs(self):
+        """
+        Generate the agent views of all the environments at once
+        """
+
+        size = self.agent_view_size
+        half = size // 2
+        batch = np.arange(self.num_envs)
+
+        # World coordinates of each view cell, the agent facing up
+        # from the middle of the bottom row of its view
+        f_vec = np.array(DIR_TO_VEC)[self.agent_dir]
+        r_vec = np.stack((-f_vec[:, 1], f_vec[:, 0]), axis=1)
+        side = np.arange(size) - half
+        ahead = size - 1 - np.arange(size)
+        coords = (
+            self.agent_pos[:, np.newaxis, np.newaxis, :] + self._pad +
+            f_vec[:, np.newaxis, np.newaxis, :] * ahead[np.newaxis, np.newaxis, :, np.newaxis] +
+            r_vec[:, np.newaxis, np.newaxis, :] * side[np.newaxis, :, np.newaxis, np.newaxis]
+        )
+        image = self._grids[batch[:, np.newaxis, np.newaxis], coords[..., 0], coords[..., 1]]
+
+        # Process occluders and visibility
+        if not self.see_through_walls:
+            see_behind = SEE_BEHIND[image[..., 0], image[..., 2]]
+            vis_mask = self._vis_mask(see_behind)
+        else:
+            vis_mask = np.ones(image.shape[:3], dtype=bool)
+
+        # Make it so the agents see what they are carrying
+        image[:, half, size - 1] = self.carrying
+        image[~vis_mask] = 0
+
+        return {
+            'image': image,
+            'direction': self.agent_dir.copy(),
+            'mission': list(self.missions)
+        }
+
+    def render(self, tile_size=TILE_PIXELS):
+        """
+        Render the whole grids of all the environments into one
+        (num_envs, height, width, 3) array
+        """
+
+        return Grid.render_encoding(self.grids, tile_size, self.agent_pos, self.agent_dir)
+
+    def get_obs_render(self, image, tile_size=TILE_PIXELS//2):
+        """
+        Render a batch of agent observations for visualization
+        """
+
+        return Grid.render_obs(image, tile_size)
+
+    def _vis_mask(self, see_behind):
+        """
+        Batched version of Grid.vis_mask, processing the same row of every
+        view at once. The agents are at the bottom middle of their views.
+        """
+
+        num_envs, size, _ = see_behind.shape
+
+        # Pack each row of the transparency planes into an integer
+        bits = np.arange(size, dtype=np.int64)
+        rows = see_behind.transpose(0, 2, 1).dot(1 << bits)
+
+        seen = np.zeros((num_envs, size), dtype=np.int64)
+        above = np.full(num_envs, 1 << (size // 2), dtype=np.int64)
+
+        for j in reversed(range(0, size)):
+            if self._vis_tables is not None:
+                key = above | (rows[:, j] << size)
+                seen[:, j] = self._vis_tables[0][key]
+                above = self._vis_tables[1][key]
+            else:
+                seen[:, j], above = Grid._vis_row(above, rows[:, j], size)
+
+        mask = (seen[:, np.newaxis, :] >> bits[np.newaxis, :, np.newaxis]) & 1
+
+        return mask.astype(bool)
@@ -1,11 +1,12 @@
 import math
 import operator
 from functools import reduce
+from collections import OrderedDict
 
 import numpy as np
 import gym
 from gym import error, spaces, utils
-from .minigrid import OBJECT_TO_IDX, COLOR_TO_IDX, STATE_TO_IDX
+from .minigrid import Grid, OBJECT_TO_IDX, COLOR_TO_IDX, STATE_TO_IDX, DIR_TO_VEC, PACKED_CELL_BITS
 
 class ReseedWrapper(gym.core.Wrapper):
     """
@@ -29,74 +30,390 @@ class ReseedWrapper(gym.core.Wrapper):
         obs, reward, done, info = self.env.step(action)
         return obs, reward, done, info
 
-class ActionBonus(gym.core.Wrapper):
+class VisitCounts:
     """
-    Wrapper which adds an exploration bonus.
-    This is a reward to encourage exploration of less
-    visited (state,action) pairs.
+    Dense table of visit counts, used to compute exploration bonuses of
+    1 / sqrt(count). Counts are floats so that they can be decayed.
     """
 
-    def __init__(self, env):
+    def __init__(self, shape):
+        self.counts = np.zeros(shape, dtype=np.float64)
+
+    def visit(self, *index):
+        """
+        Count a visit to the given index, and return the exploration
+        bonus for it. Each index component can also be an array, to count
+        visits from a batch of environments at once. Repeated indices
+        within a batch are all counted before computing their bonus.
+        """
+
+        if np.ndim(index[0]) == 0:
+            self.counts[index] += 1
+            return 1 / math.sqrt(self.counts[index])
+
+        np.add.at(self.counts, index, 1)
+
+        return 1 / np.sqrt(self.counts[index])
+
+    def reset(self):
+        self.counts[...] = 0
+
+    def decay(self, factor):
+        self.counts *= factor
+
+    def save(self, path):
+        np.save(path, self.counts)
+
+    def load(self, path):
+        self.counts[...] = np.load(path)
+
+class SharedVisitCounts(VisitCounts):
+    """
+    Visit counts kept in shared memory, so that worker processes all see
+    global counts. The process creating the table passes no name, and
+    the workers attach to it by passing its name. Each worker counts its
+    visits privately and adds them to the shared table every sync_every
+    visits, optionally holding lock, a multiprocessing.Lock inherited from
+    the creating process. Without a lock, concurrent merges of the same
+    entries can rarely lose some visits.
+
+    Resetting or decaying the counts acts on the shared table, so it is
+    done from a single process, such as the one which created the table,
+    and the bonus wrappers do not accept episodic or decayed shared
+    counts.
+
+    This requires multiprocessing.shared_memory, from Python 3.8.
+    """
+
+    def __init__(self, shape, name=None, sync_every=1, lock=None):
+        from multiprocessing import shared_memory
+
+        size = int(np.prod(shape)) * np.dtype(np.float64).itemsize
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self.name = self.shm.name
+        self.counts = np.ndarray(shape, dtype=np.float64, buffer=self.shm.buf)
+        if name is None:
+            self.counts[...] = 0
+
+        # Visits not merged into the shared table yet
+        self.pending = np.zeros(shape, dtype=np.float64)
+        self.num_pending = 0
+        self.sync_every = sync_every
+        self.lock = lock
+
+    def visit(self, *index):
+        if np.ndim(index[0]) == 0:
+            self.pending[index] += 1
+            self.num_pending += 1
+        else:
+            np.add.at(self.pending, index, 1)
+            self.num_pending += len(index[0])
+
+        if self.num_pending >= self.sync_every:
+            self.sync()
+
+        count = self.counts[index] + self.pending[index]
+
+        if np.ndim(index[0]) == 0:
+            return 1 / math.sqrt(count)
+
+        return 1 / np.sqrt(count)
+
+    def sync(self):
+        """
+        Add the visits counted by this process to the shared table
+        """
+
+        index = np.nonzero(self.pending)
+
+        if self.lock is not None:
+            with self.lock:
+                self.counts[index] += self.pending[index]
+        else:
+            self.counts[index] += self.pending[index]
+
+        self.pending[index] = 0
+        self.num_pending = 0
+
+    def reset(self):
+        self.pending[...] = 0
+        self.num_pending = 0
+
+        if self.lock is not None:
+            with self.lock:
+                super().reset()
+        else:
+            super().reset()
+
+    def decay(self, factor):
+        self.sync()
+
+        if self.lock is not None:
+            with self.lock:
+                super().decay(factor)
+        else:
+            super().decay(factor)
+
+    def save(self, path):
+        self.sync()
+        super().save(path)
+
+    def close(self):
+        """
+        Detach from the shared table, after merging the pending visits
+        """
+
+        self.sync()
+        self.counts = None
+        self.shm.close()
+
+    def unlink(self):
+        """
+        Free the shared table, once every process has closed it
+        """
+
+        self.shm.unlink()
+
+def _multiply_shift(keys, salts, bits):
+    """
+    Hash 64-bit keys into bits-bit indices, with one multiply-shift hash
+    function per salt. Returns an array of shape (len(salts), len(keys)).
+    """
+
+    keys = np.asarray(keys, dtype=np.uint64).reshape(1, -1)
+    salts = salts.reshape(-1, 1)
+
+    return ((salts * keys) >> np.uint64(64 - bits)).astype(np.intp)
+
+def _hash_salts(num_salts, seed):
+    """
+    Random odd 64-bit multipliers for _multiply_shift
+    """
+
+    rng = np.random.RandomState(seed)
+    salts = rng.randint(0, 1 << 62, size=num_salts, dtype=np.int64).astype(np.uint64)
+
+    return (salts << np.uint64(1)) | np.uint64(1)
+
+class CountMinSketch:
+    """
+    Approximate counts of 64-bit keys, such as state hashes, in a fixed
+    amount of memory: depth rows of width counters, width being a power of
+    two. Counts are never underestimated, and overestimated by at most
+    e * total / width with probability 1 - exp(-depth).
+    """
+
+    def __init__(self, width=1 << 16, depth=4, seed=0):
+        assert width & (width - 1) == 0, 'width must be a power of two'
+
+        self.width = width
+        self.depth = depth
+        self.bits = width.bit_length() - 1
+        self.salts = _hash_salts(depth, seed)
+        self.table = np.zeros((depth, width), dtype=np.uint32)
+        self.rows = np.arange(depth)[:, np.newaxis]
+
+    def add(self, keys):
+        """
+        Count one occurrence of each key, and return the estimated counts
+        of the keys after counting them
+        """
+
+        idx = _multiply_shift(keys, self.salts, self.bits)
+        np.add.at(self.table, (self.rows, idx), 1)
+
+        return self.table[self.rows, idx].min(axis=0)
+
+    def count(self, keys):
+        """
+        Get the estimated counts of keys
+        """
+
+        idx = _multiply_shift(keys, self.salts, self.bits)
+
+        return self.table[self.rows, idx].min(axis=0)
+
+    def save(self, path):
+        np.save(path, self.table)
+
+    def load(self, path):
+        self.table[...] = np.load(path)
+
+class BloomFilter:
+    """
+    Approximate set of 64-bit keys using num_bits bits, num_bits being a
+    power of two. Membership tests have no false negatives, and false
+    positives become likely as the number of keys approaches
+    num_bits / num_hashes.
+    """
+
+    def __init__(self, num_bits=1 << 16, num_hashes=4, seed=1):
+        assert num_bits & (num_bits - 1) == 0, 'num_bits must be a power of two'
+
+        self.bits = num_bits.bit_length() - 1
+        self.salts = _hash_salts(num_hashes, seed)
+        self.array = np.zeros(num_bits, dtype=bool)
+
+    def add(self, keys):
+        """
+        Add keys to the set, and return which of them were already in it
+        """
+
+        idx = _multiply_shift(keys, self.salts, self.bits)
+        present = self.array[idx].all(axis=0)
+        self.array[idx] = True
+
+        return present
+
+    def __contains__(self, key):
+        idx = _multiply_shift(key, self.salts, self.bits)
+        return bool(self.array[idx].all())
+
+    def clear(self):
+        self.array[...] = False
+
+class CountBonus(gym.core.Wrapper):
+    """
+    Base class for the wrappers adding an exploration bonus computed from
+    visit counts. The counts can be reset at the start of every episode,
+    or multiplied by decay, and saved and loaded with checkpoints. Passing
+    counts, such as SharedVisitCounts, replaces the private table.
+    """
+
+    def __init__(self, env, shape, decay=1.0, episodic=False, counts=None):
         super().__init__(env)
-        self.counts = {}
 
-    def step(self, action):
-        obs, reward, done, info = self.env.step(action)
+        if counts is None:
+            counts = VisitCounts(shape)
+        assert counts.counts.shape == shape, counts.counts.shape
 
-        env = self.unwrapped
-        tup = (tuple(env.agent_pos), env.agent_dir, action)
+        # Every worker would reset or decay the counts of all the others
+        if isinstance(counts, SharedVisitCounts) and (episodic or decay != 1):
+            raise ValueError('shared counts cannot be episodic or decayed by the wrappers')
 
-        # Get the count for this (s,a) pair
-        pre_count = 0
-        if tup in self.counts:
-            pre_count = self.counts[tup]
+        self.counts = counts
+        self.decay = decay
+        self.episodic = episodic
 
-        # Update the count for this (s,a) pair
-        new_count = pre_count + 1
-        self.counts[tup] = new_count
+    def visit_index(self, action):
+        """
+        Index of the visit counted after taking an action
+        """
+
+        raise NotImplementedError
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
 
-        bonus = 1 / math.sqrt(new_count)
+        bonus = self.counts.visit(*self.visit_index(action))
         reward += bonus
 
         return obs, reward, done, info
 
     def reset(self, **kwargs):
+        if self.episodic:
+            self.counts.reset()
+        elif self.decay != 1:
+            self.counts.decay(self.decay)
+
         return self.env.reset(**kwargs)
 
-class StateBonus(gym.core.Wrapper):
+    def save(self, path):
+        self.counts.save(path)
+
+    def load(self, path):
+        self.counts.load(path)
+
+class ActionBonus(CountBonus):
+    """
+    Wrapper which adds an exploration bonus.
+    This is a reward to encourage exploration of less
+    visited (state,action) pairs.
+    """
+
+    def __init__(self, env, decay=1.0, episodic=False, counts=None):
+        env_u = env.unwrapped
+        shape = (env_u.width, env_u.height, len(DIR_TO_VEC), env.action_space.n)
+
+        super().__init__(env, shape, decay, episodic, counts)
+
+    def visit_index(self, action):
+        env = self.unwrapped
+        return env.agent_pos[0], env.agent_pos[1], env.agent_dir, action
+
+class StateBonus(CountBonus):
     """
     Adds an exploration bonus based on which positions
     are visited on the grid.
     """
 
-    def __init__(self, env):
-        super().__init__(env)
-        self.counts = {}
+    def __init__(self, env, decay=1.0, episodic=False, counts=None):
+        env_u = env.unwrapped
+        shape = (env_u.width, env_u.height)
 
-    def step(self, action):
-        obs, reward, done, info = self.env.step(action)
+        super().__init__(env, shape, decay, episodic, counts)
 
-        # Tuple based on which we index the counts
+    def visit_index(self, action):
         # We use the position after an update
         env = self.unwrapped
-        tup = (tuple(env.agent_pos))
+        return env.agent_pos[0], env.agent_pos[1]
 
-        # Get the count for this key
-        pre_count = 0
-        if tup in self.counts:
-            pre_count = self.counts[tup]
+class NoveltyBonus(gym.core.Wrapper):
+    """
+    Exploration bonus for environments with too many states to count
+    exactly. States are identified by their Zobrist hash, which is
+    maintained incrementally, and counted approximately in a count-min
+    sketch, so memory stays constant however many states are visited.
+
+    The bonus is 1 / sqrt(count). When episodic is set, it is only given
+    the first time a state is visited in an episode, as tracked by a
+    Bloom filter which is cleared on reset.
+    """
 
-        # Update the count for this key
-        new_count = pre_count + 1
-        self.counts[tup] = new_count
+    def __init__(
+        self,
+        env,
+        width=1 << 16,
+        depth=4,
+        bloom_bits=1 << 16,
+        bloom_hashes=4,
+        episodic=True
+    ):
+        super().__init__(env)
 
-        bonus = 1 / math.sqrt(new_count)
-        reward += bonus
+        self.sketch = CountMinSketch(width, depth)
+        self.episodic = episodic
+        self.seen = BloomFilter(bloom_bits, bloom_hashes) if episodic else None
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
+
+        state_hash = self.unwrapped.zobrist_hash()
+        count = int(self.sketch.add(state_hash)[0])
+
+        if self.seen is None or not self.seen.add(state_hash)[0]:
+            reward += 1 / math.sqrt(count)
 
         return obs, reward, done, info
 
     def reset(self, **kwargs):
-        return self.env.reset(**kwargs)
+        obs = self.env.reset(**kwargs)
+
+        if self.seen is not None:
+            self.seen.clear()
+            self.seen.add(self.unwrapped.zobrist_hash())
+
+        return obs
+
+    def save(self, path):
+        self.sketch.save(path)
+
+    def load(self, path):
+        self.sketch.load(path)
 
 class ImgObsWrapper(gym.core.ObservationWrapper):
     """
@@ -110,46 +427,83 @@ class ImgObsWrapper(gym.core.ObservationWrapper):
     def observation(self, obs):
         return obs['image']
 
+def one_hot_table():
+    """
+    Get the one-hot encoding of every cell, with one bit per type, color
+    and state, as a boolean array indexed by the (type, color, state) of
+    the cell
+    """
+
+    num_types = len(OBJECT_TO_IDX)
+    num_colors = len(COLOR_TO_IDX)
+    num_states = len(STATE_TO_IDX)
+    num_bits = num_types + num_colors + num_states
+
+    types, colors, states = np.indices((num_types, num_colors, num_states))
+    bits = np.eye(num_bits, dtype=bool)
+
+    return bits[types] | bits[num_types + colors] | bits[num_types + num_colors + states]
+
+# Offsets of the (type, color, state) encoding of a cell in the flattened
+# one-hot table
+ONE_HOT_STRIDES = np.array((len(COLOR_TO_IDX) * len(STATE_TO_IDX), len(STATE_TO_IDX), 1))
+
+def one_hot_encode(rows, image, out=None):
+    """
+    Encode the cells of an image using a table from one_hot_table reshaped
+    to one row per cell encoding, by gathering the row of each cell. The
+    rows are written directly into out when it is given.
+    """
+
+    codes = image.dot(ONE_HOT_STRIDES)
+
+    # Without index checks np.take writes to out without buffering, cell
+    # encodings are always within the table
+    return np.take(rows, codes, axis=0, out=out, mode='clip')
+
 class OneHotPartialObsWrapper(gym.core.ObservationWrapper):
     """
     Wrapper to get a one-hot encoding of a partially observable
     agent view as observation.
+
+    The encoding can be produced in any dtype, for instance float32 to be
+    fed to a network as is, or with the bits of each cell packed into
+    bytes (see np.unpackbits). With reuse_buffer, the same image array is
+    returned every time and the next observation overwrites it.
     """
 
-    def __init__(self, env, tile_size=8):
+    def __init__(self, env, tile_size=8, dtype='uint8', packed=False, reuse_buffer=False):
         super().__init__(env)
 
         self.tile_size = tile_size
 
         obs_shape = env.observation_space['image'].shape
 
-        # Number of bits per cell
-        num_bits = len(OBJECT_TO_IDX) + len(COLOR_TO_IDX) + len(STATE_TO_IDX)
+        table = one_hot_table()
+
+        if packed:
+            if np.dtype(dtype) != np.uint8:
+                raise ValueError('packed one-hot encodings are uint8')
+            table = np.packbits(table, axis=-1)
+        else:
+            table = table.astype(dtype)
+
+        self.table = table.reshape(-1, table.shape[-1])
+        self.buffer = None
+        if reuse_buffer:
+            self.buffer = np.zeros(obs_shape[:2] + table.shape[-1:], dtype=table.dtype)
 
         self.observation_space.spaces["image"] = spaces.Box(
             low=0,
-            high=255,
-            shape=(obs_shape[0], obs_shape[1], num_bits),
-            dtype='uint8'
+            high=255 if table.dtype == np.uint8 else 1,
+            shape=(obs_shape[0], obs_shape[1], table.shape[-1]),
+            dtype=table.dtype
         )
 
     def observation(self, obs):
-        img = obs['image']
-        out = np.zeros(self.observation_space.spaces['image'].shape, dtype='uint8')
-
-        for i in range(img.shape[0]):
-            for j in range(img.shape[1]):
-                type = img[i, j, 0]
-                color = img[i, j, 1]
-                state = img[i, j, 2]
-
-                out[i, j, type] = 1
-                out[i, j, len(OBJECT_TO_IDX) + color] = 1
-                out[i, j, len(OBJECT_TO_IDX) + len(COLOR_TO_IDX) + state] = 1
-
         return {
             'mission': obs['mission'],
-            'image': out
+            'image': one_hot_encode(self.table, obs['image'], out=self.buffer)
         }
 
 class RGBImgObsWrapper(gym.core.ObservationWrapper):
@@ -235,68 +589,243 @@ class FullyObsWrapper(gym.core.ObservationWrapper):
 
     def observation(self, obs):
         env = self.unwrapped
-        full_grid = env.grid.encode()
-        full_grid[env.agent_pos[0]][env.agent_pos[1]] = np.array([
+        full_grid = env.grid.encoding.copy()
+        full_grid[env.agent_pos[0], env.agent_pos[1]] = (
             OBJECT_TO_IDX['agent'],
             COLOR_TO_IDX['red'],
             env.agent_dir
-        ])
+        )
 
         return {
             'mission': obs['mission'],
             'image': full_grid
         }
 
+class PackedObsWrapper(gym.core.ObservationWrapper):
+    """
+    Compact observations for replay buffers, packing the encoding of each
+    cell into one uint16 with Grid.pack, or the whole image into a
+    fixed-size uint8 array with Grid.pack_bytes when as_bytes is set.
+    Use Grid.unpack and Grid.unpack_bytes to get the images back.
+    """
+
+    def __init__(self, env, as_bytes=False):
+        super().__init__(env)
+
+        self.as_bytes = as_bytes
+
+        width, height, _ = env.observation_space.spaces['image'].shape
+
+        if as_bytes:
+            num_bytes = (width * height * PACKED_CELL_BITS + 7) // 8
+            image_space = spaces.Box(
+                low=0,
+                high=255,
+                shape=(num_bytes,),
+                dtype='uint8'
+            )
+        else:
+            image_space = spaces.Box(
+                low=0,
+                high=(1 << PACKED_CELL_BITS) - 1,
+                shape=(width, height),
+                dtype='uint16'
+            )
+
+        self.observation_space.spaces['image'] = image_space
+
+    def observation(self, obs):
+        if self.as_bytes:
+            image = Grid.pack_bytes(obs['image'])
+        else:
+            image = Grid.pack(obs['image'])
+
+        return {
+            'mission': obs['mission'],
+            'image': image
+        }
+
+class FrameStackWrapper(gym.core.Wrapper):
+    """
+    Stack the last num_frames images of the observations, and their
+    directions if stack_direction is set, oldest first. This works on any
+    image format, such as the packed cells of PackedObsWrapper.
+
+    Frames are written into ring buffers holding each frame twice, so
+    that the last num_frames frames are always contiguous and returned as
+    views without copying. The next step overwrites them: copy what you
+    keep. On reset, the first frame is repeated num_frames times.
+    """
+
+    def __init__(self, env, num_frames=4, stack_direction=False):
+        super().__init__(env)
+
+        self.num_frames = num_frames
+
+        self.keys = ['image']
+        if stack_direction:
+            self.keys.append('direction')
+
+        obs_spaces = dict(self.observation_space.spaces)
+        obs_spaces['direction'] = spaces.Box(low=0, high=3, shape=(), dtype='int64')
+
+        # Ring buffers, the frame of step t being at t % num_frames and
+        # t % num_frames + num_frames
+        self.buffers = {}
+        for key in self.keys:
+            space = obs_spaces[key]
+            shape = (num_frames,) + space.shape
+            self.buffers[key] = np.zeros((2 * num_frames,) + space.shape, dtype=space.dtype)
+            self.observation_space.spaces[key] = spaces.Box(
+                low=np.broadcast_to(space.low, shape),
+                high=np.broadcast_to(space.high, shape),
+                dtype=space.dtype
+            )
+
+        self.pos = 0
+
+    def _push(self, obs):
+        # The inner observation can be a buffer reused by the environment
+        obs = dict(obs)
+
+        self.pos = (self.pos + 1) % self.num_frames
+
+        for key in self.keys:
+            buffer = self.buffers[key]
+            buffer[self.pos] = obs[key]
+            buffer[self.pos + self.num_frames] = obs[key]
+
+            # Frames from the oldest one to the one just written
+            obs[key] = buffer[self.pos + 1:self.pos + self.num_frames + 1]
+
+        return obs
+
+    def reset(self, **kwargs):
+        obs = self.env.reset(**kwargs)
+
+        for key in self.keys:
+            self.buffers[key][...] = obs[key]
+
+        return self._push(obs)
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
+
+        return self._push(obs), reward, done, info
+
+class MissionEncoder:
+    """
+    Encode mission strings using a one-hot scheme over 27 character codes,
+    letters and spaces, as flat float32 arrays. The encodings of the last
+    cacheSize missions are cached.
+    """
+
+    def __init__(self, maxStrLen=96, cacheSize=64):
+        self.maxStrLen = maxStrLen
+        self.numCharCodes = 27
+        self.size = self.maxStrLen * self.numCharCodes
+
+        # Code of each byte value, letters are case-insensitive and
+        # characters other than letters and spaces have code -1
+        self.charCodes = np.full(256, -1, dtype=np.int64)
+        letters = np.arange(26)
+        self.charCodes[ord('a') + letters] = letters
+        self.charCodes[ord('A') + letters] = letters
+        self.charCodes[ord(' ')] = 26
+
+        # Encoded missions, least recently used first
+        self.cacheSize = cacheSize
+        self.cache = OrderedDict()
+
+    def encode(self, mission):
+        """
+        Get the flat one-hot encoding of a mission string
+        """
+
+        if mission in self.cache:
+            self.cache.move_to_end(mission)
+            return self.cache[mission]
+
+        assert len(mission) <= self.maxStrLen, 'mission string too long ({} chars)'.format(len(mission))
+
+        chars = np.frombuffer(mission.encode('ascii', 'replace'), dtype=np.uint8)
+        codes = self.charCodes[chars]
+
+        # Other characters take the code of the character before them
+        known = np.where(codes >= 0, np.arange(len(codes)), -1)
+        known = np.maximum.accumulate(known)
+        positions = np.flatnonzero(known >= 0)
+
+        strArray = np.zeros(shape=(self.maxStrLen, self.numCharCodes), dtype='float32')
+        strArray[positions, codes[known[positions]]] = 1
+
+        strArray = strArray.reshape(-1)
+        strArray.flags.writeable = False
+
+        self.cache[mission] = strArray
+        if len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+
+        return strArray
+
 class FlatObsWrapper(gym.core.ObservationWrapper):
     """
     Encode mission strings using a one-hot scheme,
     and combine these with observed images into one flat array
+
+    The encodings of the last missionCacheSize missions are cached. With
+    reuse_buffer, the same array is returned every time and the next
+    observation overwrites it, only the image part being copied when the
+    mission does not change.
     """
 
-    def __init__(self, env, maxStrLen=96):
+    def __init__(self, env, maxStrLen=96, missionCacheSize=64, reuse_buffer=False):
         super().__init__(env)
 
+        self.missionEncoder = MissionEncoder(maxStrLen, missionCacheSize)
         self.maxStrLen = maxStrLen
-        self.numCharCodes = 27
+        self.numCharCodes = self.missionEncoder.numCharCodes
+        self.missionCache = self.missionEncoder.cache
 
         imgSpace = env.observation_space.spaces['image']
         imgSize = reduce(operator.mul, imgSpace.shape, 1)
+        self.imgSize = imgSize
 
         self.observation_space = spaces.Box(
             low=0,
             high=255,
-            shape=(imgSize + self.numCharCodes * self.maxStrLen,),
+            shape=(imgSize + self.missionEncoder.size,),
             dtype='uint8'
         )
 
-        self.cachedStr = None
-        self.cachedArray = None
+        self.buffer = None
+        self.bufferMission = None
+        if reuse_buffer:
+            self.buffer = np.zeros(self.observation_space.shape, dtype='float32')
+
+    def encode_mission(self, mission):
+        """
+        Get the flat one-hot encoding of a mission string
+        """
+
+        return self.missionEncoder.encode(mission)
 
     def observation(self, obs):
         image = obs['image']
         mission = obs['mission']
 
-        # Cache the last-encoded mission string
-        if mission != self.cachedStr:
-            assert len(mission) <= self.maxStrLen, 'mission string too long ({} chars)'.format(len(mission))
-            mission = mission.lower()
+        if self.buffer is None:
+            out = np.empty(self.observation_space.shape, dtype='float32')
+            out[self.imgSize:] = self.encode_mission(mission)
+        else:
+            out = self.buffer
+            if mission != self.bufferMission:
+                out[self.imgSize:] = self.encode_mission(mission)
+                self.bufferMission = mission
 
-            strArray = np.zeros(shape=(self.maxStrLen, self.numCharCodes), dtype='float32')
+        out[:self.imgSize] = image.reshape(-1)
 
-            for idx, ch in enumerate(mission):
-                if ch >= 'a' and ch <= 'z':
-                    chNo = ord(ch) - ord('a')
-                elif ch == ' ':
-                    chNo = ord('z') - ord('a') + 1
-                assert chNo < self.numCharCodes, '%s : %d' % (ch, chNo)
-                strArray[idx, chNo] = 1
-
-            self.cachedStr = mission
-            self.cachedArray = strArray
-
-        obs = np.concatenate((image.flatten(), self.cachedArray.flatten()))
-
-        return obs
+        return out
 
 class ViewSizeWrapper(gym.core.Wrapper):
     """
@@ -332,6 +861,142 @@ class ViewSizeWrapper(gym.core.Wrapper):
     def step(self, action):
         return self.env.step(action)
 
+class FusedObsWrapper(gym.core.ObservationWrapper):
+    """
+    Build the final observation in one pass from the agent's view, as
+    described by a spec which replaces a chain of observation wrappers:
+
+    - view_size: size of the agent's view, as with ViewSizeWrapper
+    - one_hot: one-hot encode the cells, as with OneHotPartialObsWrapper
+    - direction: include the direction of the agent, one-hot encoded
+      after the image when flattening
+    - mission: include the mission string, one-hot encoded after the
+      image and direction as with FlatObsWrapper when flattening
+    - flatten: produce one flat array, as with FlatObsWrapper
+    - dtype: dtype of the image or flat array, by default the one the
+      equivalent wrapper chain produces
+
+    For instance, FusedObsWrapper(env, view_size=5, one_hot=True,
+    flatten=True) gives the same observation space and observations as
+    FlatObsWrapper(OneHotPartialObsWrapper(ViewSizeWrapper(env, 5))).
+    A spec stored as a dictionary can be passed as keyword arguments.
+    With reuse_buffer, the same array is returned every time and the next
+    observation overwrites it.
+    """
+
+    def __init__(
+        self,
+        env,
+        view_size=None,
+        one_hot=False,
+        direction=False,
+        mission=True,
+        flatten=False,
+        dtype=None,
+        maxStrLen=96,
+        reuse_buffer=False
+    ):
+        super().__init__(env)
+
+        self.one_hot = one_hot
+        self.direction = direction
+        self.mission = mission
+        self.flatten = flatten
+
+        if view_size is not None:
+            assert view_size % 2 == 1
+            assert view_size >= 3
+            env.unwrapped.agent_view_size = view_size
+            img_shape = (view_size, view_size, 3)
+        else:
+            img_shape = env.observation_space.spaces['image'].shape
+
+        # FlatObsWrapper declares uint8 observations but produces float32
+        # ones when concatenating the mission encoding
+        space_dtype = np.dtype(dtype or 'uint8')
+        self.dtype = np.dtype(dtype or ('float32' if flatten and mission else 'uint8'))
+
+        # Encoding of every cell, one row per cell encoding
+        if one_hot:
+            table = one_hot_table().astype(self.dtype)
+            self.table = table.reshape(-1, table.shape[-1])
+            img_shape = img_shape[:2] + self.table.shape[-1:]
+
+        self.img_shape = img_shape
+        self.img_size = reduce(operator.mul, img_shape, 1)
+
+        if flatten:
+            size = self.img_size
+            if direction:
+                size += len(DIR_TO_VEC)
+            if mission:
+                self.mission_encoder = MissionEncoder(maxStrLen)
+                size += self.mission_encoder.size
+            shape = (size,)
+
+            self.observation_space = spaces.Box(
+                low=0,
+                high=255,
+                shape=shape,
+                dtype=space_dtype
+            )
+        else:
+            shape = img_shape
+
+            obs_spaces = {
+                'image': spaces.Box(
+                    low=0,
+                    high=255 if space_dtype == np.uint8 or not one_hot else 1,
+                    shape=shape,
+                    dtype=space_dtype
+                )
+            }
+            if direction:
+                obs_spaces['direction'] = spaces.Discrete(len(DIR_TO_VEC))
+            self.observation_space = spaces.Dict(obs_spaces)
+
+        self.buffer = None
+        self.buffer_mission = None
+        if reuse_buffer:
+            self.buffer = np.zeros(shape, dtype=self.dtype)
+
+    def observation(self, obs):
+        image = obs['image']
+
+        if self.buffer is not None:
+            out = self.buffer
+        else:
+            out = np.empty(self.observation_space.shape if self.flatten else self.img_shape, dtype=self.dtype)
+            self.buffer_mission = None
+
+        cells = out[:self.img_size].reshape(self.img_shape) if self.flatten else out
+        if self.one_hot:
+            one_hot_encode(self.table, image, out=cells)
+        else:
+            cells[...] = image
+
+        if not self.flatten:
+            obs_dict = {'image': out}
+            if self.direction:
+                obs_dict['direction'] = obs['direction']
+            if self.mission:
+                obs_dict['mission'] = obs['mission']
+            return obs_dict
+
+        offset = self.img_size
+
+        if self.direction:
+            out[offset:offset + len(DIR_TO_VEC)] = 0
+            out[offset + obs['direction']] = 1
+            offset += len(DIR_TO_VEC)
+
+        if self.mission and obs['mission'] != self.buffer_mission:
+            out[offset:] = self.mission_encoder.encode(obs['mission'])
+            if self.buffer is not None:
+                self.buffer_mission = obs['mission']
+
+        return out
+
 from .minigrid import Goal
 class DirectionObsWrapper(gym.core.ObservationWrapper):
     """
@@ -346,9 +1011,9 @@ class DirectionObsWrapper(gym.core.ObservationWrapper):
     def reset(self):
         obs = self.env.reset()
         if not self.goal_position:
-            self.goal_position = [x for x,y in enumerate(self.grid.grid) if isinstance(y,(Goal) ) ]
+            self.goal_position = self.grid.find('goal')
             if len(self.goal_position) >= 1: # in case there are multiple goals , needs to be handled for other env types
-                self.goal_position = (int(self.goal_position[0]/self.height) , self.goal_position[0]%self.width)
+                self.goal_position = min(self.goal_position, key=lambda pos: (pos[1], pos[0]))
         return obs
 
     def observation(self, obs):
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 
+import os
+import copy
+import math
 import random
 import numpy as np
 import gym
 from gym_minigrid.register import env_list
-from gym_minigrid.minigrid import Grid, OBJECT_TO_IDX
+from gym_minigrid.minigrid import Grid, TileAtlas, OBJECT_TO_IDX, COLOR_TO_IDX, Door, Key, Ball, Box, Wall, Lava
 
 # Test specifically importing a specific environment
 from gym_minigrid.envs import DoorKeyEnv
@@ -115,7 +118,9 @@ for env_idx, env_name in enumerate(env_list):
     wrappers = [
         RGBImgObsWrapper,
         RGBImgPartialObsWrapper,
-        OneHotPartialObsWrapper
+        OneHotPartialObsWrapper,
+        PackedObsWrapper,
+        FrameStackWrapper
     ]
     for wrapper in wrappers:
         env = wrapper(gym.make(env_name))
@@ -154,3 +159,629 @@ for i in range(0, 500):
     assert agent_sees_goal == goal_visible
     if done:
         env.reset()
+
+##############################################################################
+
+print('testing grid array storage')
+grid = Grid(5, 4)
+grid.wall_rect(0, 0, 5, 4)
+door = Door('yellow', is_locked=True)
+grid.set(2, 1, door)
+assert np.array_equal(grid.encode()[2, 1], (OBJECT_TO_IDX['door'], 4, 2))
+
+# State changes of objects are reflected in the grid encoding
+door.is_locked = False
+door.is_open = True
+assert np.array_equal(grid.encode()[2, 1], (OBJECT_TO_IDX['door'], 4, 0))
+grid.set(2, 1, None)
+assert grid.encode()[2, 1, 0] == OBJECT_TO_IDX['empty']
+
+# Rotating four times gives back the original grid
+grid.set(1, 2, Key('red'))
+rotated = grid
+for i in range(4):
+    rotated = rotated.rotate_left()
+assert rotated == grid
+assert rotated.get(1, 2) is grid.get(1, 2)
+assert grid.rotate_left().get(2, 3).type == 'key'
+
+# The cached encoding is a read-only view which follows grid changes
+box = Box('purple', contains=Ball('blue'))
+grid.set(3, 2, box)
+view = grid.encoding
+assert not view.flags.writeable
+assert view[3, 2, 0] == OBJECT_TO_IDX['box']
+env = gym.make('MiniGrid-Empty-5x5-v0')
+env.grid = grid
+box.toggle(env, (3, 2))
+assert np.array_equal(view[3, 2], (OBJECT_TO_IDX['ball'], COLOR_TO_IDX['blue'], 0))
+
+# Walls built in bulk match walls built cell by cell, and the objects
+# they replace no longer report changes to the grid
+bulk = Grid(6, 5)
+key = Key('red')
+bulk.set(2, 2, key)
+bulk.horz_wall(1, 2, 4, obj_type=Lava)
+bulk.vert_wall(4, 0)
+cells = Grid(6, 5)
+for i in range(1, 5):
+    cells.set(i, 2, Lava())
+for j in range(5):
+    cells.set(4, j, Wall())
+assert bulk == cells
+assert np.array_equal(bulk._see_behind, cells._see_behind)
+assert bulk.get(4, 3)._grid_pos == (4, 3)
+assert key._grid is None
+
+print('testing gen_obs_image')
+for env_name in ['MiniGrid-KeyCorridorS3R3-v0', 'MiniGrid-Dynamic-Obstacles-8x8-v0']:
+    env = gym.make(env_name)
+    env.reset()
+    for i in range(0, 200):
+        obs, reward, done, info = env.step(random.randint(0, env.action_space.n - 1))
+        grid, vis_mask = env.gen_obs_grid()
+        image, vis_mask2 = env.gen_obs_image()
+        assert np.array_equal(vis_mask, vis_mask2)
+        assert np.array_equal(image, grid.encode(vis_mask))
+        assert np.array_equal(image, obs['image'])
+        if done:
+            env.reset()
+
+print('testing visibility lookup tables')
+for size in [3, 5, 7]:
+    agent_pos = (size // 2, size - 1)
+    for i in range(0, 200):
+        see_behind = np.random.rand(size, size) < 0.7
+        Grid.vis_table_sizes = ()
+        mask = Grid.vis_mask(see_behind, agent_pos)
+        Grid.vis_table_sizes = (3, 5, 7)
+        assert np.array_equal(mask, Grid.vis_mask(see_behind, agent_pos))
+        out = np.empty((size, size), dtype=bool)
+        assert Grid.vis_mask(see_behind, agent_pos, out=out) is out
+        assert np.array_equal(mask, out)
+        assert mask[agent_pos]
+
+print('testing MiniGridVecEnv')
+from gym_minigrid.vecenv import MiniGridVecEnv
+for env_name in ['MiniGrid-DoorKey-5x5-v0', 'MiniGrid-LavaGapS5-v0', 'MiniGrid-FourRooms-v0']:
+    # A batch of one environment follows the regular environment exactly
+    vec_env = MiniGridVecEnv(env_name, 1)
+    env = gym.make(env_name)
+    vec_env.seed(7)
+    env.seed(7)
+    vec_obs = vec_env.reset()
+    obs = env.reset()
+    for i in range(0, 500):
+        assert np.array_equal(vec_obs['image'][0], obs['image'])
+        assert vec_obs['direction'][0] == obs['direction']
+        action = random.randint(0, env.action_space.n - 1)
+        vec_obs, vec_reward, vec_done, _ = vec_env.step([action])
+        obs, reward, done, _ = env.step(action)
+        assert vec_done[0] == done
+        assert abs(vec_reward[0] - reward) < 1e-9
+        if done:
+            obs = env.reset()
+
+vec_env = MiniGridVecEnv('MiniGrid-Empty-8x8-v0', 8)
+vec_obs = vec_env.reset()
+vec_obs, _, _, _ = vec_env.step(np.zeros(8, dtype=np.int64))
+assert vec_obs['image'].shape == (8, 7, 7, 3)
+
+print('testing batched rendering')
+frames = vec_env.render(8)
+views = vec_env.get_obs_render(vec_obs['image'], 8)
+assert frames.shape == (8, 64, 64, 3) and views.shape == (8, 56, 56, 3)
+for n in range(8):
+    grid, vis_mask = Grid.decode(vec_env.grids[n])
+    assert np.array_equal(frames[n], grid.render(8, vec_env.agent_pos[n], vec_env.agent_dir[n]))
+    grid, vis_mask = Grid.decode(vec_obs['image'][n])
+    assert np.array_equal(views[n], grid.render(8, (3, 6), 3, vis_mask))
+
+print('testing Zobrist hashing')
+for env_name in ['MiniGrid-KeyCorridorS3R3-v0', 'MiniGrid-Dynamic-Obstacles-8x8-v0', 'MiniGrid-BlockedUnlockPickup-v0']:
+    env = gym.make(env_name)
+    env.unwrapped.check_hash_collisions = True
+    env.reset()
+    for i in range(0, 300):
+        action = random.randint(0, env.action_space.n - 1)
+        obs, reward, done, info = env.step(action)
+        # The incremental hash matches the one computed from scratch
+        grid = env.unwrapped.grid
+        state_hash = grid.zobrist_hash()
+        grid._hash = None
+        assert grid.zobrist_hash() == state_hash
+        assert env.unwrapped.hash() == '{:016x}'.format(env.unwrapped.zobrist_hash())
+        if done:
+            env.reset()
+
+# Turning around and back restores the hash
+env = gym.make('MiniGrid-DoorKey-8x8-v0')
+env.reset()
+state_hash = env.unwrapped.zobrist_hash()
+env.step(env.actions.left)
+assert env.unwrapped.zobrist_hash() != state_hash
+env.step(env.actions.right)
+assert env.unwrapped.zobrist_hash() == state_hash
+
+print('testing get_state and set_state')
+for env_name in ['MiniGrid-KeyCorridorS3R3-v0', 'MiniGrid-Dynamic-Obstacles-8x8-v0', 'MiniGrid-RedBlueDoors-6x6-v0']:
+    env = gym.make(env_name)
+    env.reset()
+    for i in range(0, 50):
+        state = env.unwrapped.get_state()
+        state_hash = env.unwrapped.hash()
+        rng_state = env.unwrapped.np_random.get_state()
+        actions = [random.randint(0, env.action_space.n - 1) for j in range(10)]
+
+        # Replaying the same actions from a restored state gives the
+        # same observations, including when the episode was reset
+        trajectories = []
+        for j in range(0, 2):
+            env.unwrapped.set_state(state)
+            env.unwrapped.np_random.set_state(rng_state)
+            assert env.unwrapped.hash() == state_hash
+            trajectory = []
+            for action in actions:
+                obs, reward, done, info = env.step(action)
+                trajectory.append((obs['image'].tobytes(), reward, done))
+                if done:
+                    env.reset()
+                    break
+            trajectories.append(trajectory)
+        assert trajectories[0] == trajectories[1]
+
+# Restoring a snapshot of the current state leaves the trajectory
+# unchanged, and the objects the environment refers to in the grid
+from gym_minigrid.minigrid import WorldObj
+for env_name in ['MiniGrid-Unlock-v0', 'MiniGrid-RedBlueDoors-6x6-v0', 'MiniGrid-ObstructedMaze-1Dl-v0', 'MiniGrid-Dynamic-Obstacles-6x6-v0']:
+    env = gym.make(env_name)
+    restored_env = gym.make(env_name)
+    env.seed(11)
+    restored_env.seed(11)
+    env.reset()
+    restored_env.reset()
+    for i in range(0, 300):
+        restored_env.unwrapped.set_state(restored_env.unwrapped.get_state())
+        for name in restored_env.unwrapped.state_attrs:
+            value = getattr(restored_env.unwrapped, name)
+            if isinstance(value, WorldObj) and value.cur_pos is not None:
+                assert value in restored_env.unwrapped.grid
+        action = random.randint(0, env.action_space.n - 1)
+        obs, reward, done, info = env.step(action)
+        restored_obs, restored_reward, restored_done, info = restored_env.step(action)
+        assert np.array_equal(obs['image'], restored_obs['image'])
+        assert (reward, done) == (restored_reward, restored_done)
+        if done:
+            env.reset()
+            restored_env.reset()
+
+print('testing undo')
+for env_name in ['MiniGrid-DoorKey-8x8-v0', 'MiniGrid-KeyCorridorS3R3-v0', 'MiniGrid-Dynamic-Obstacles-8x8-v0']:
+    env = gym.make(env_name)
+    env.reset()
+    env.unwrapped.enable_undo()
+    hashes = [env.unwrapped.hash()]
+    for i in range(0, 500):
+        if len(hashes) > 1 and random.random() < 0.4:
+            env.unwrapped.undo()
+            hashes.pop()
+            assert env.unwrapped.hash() == hashes[-1]
+            # Objects tracking their position are back in their cell
+            grid = env.unwrapped.grid
+            for i, j in grid.find('key') + grid.find('ball') + grid.find('box'):
+                cur_pos = grid.get(i, j).cur_pos
+                assert cur_pos is None or tuple(cur_pos) == (i, j)
+            continue
+        action = random.randint(0, env.action_space.n - 1)
+        obs, reward, done, info = env.step(action)
+        if done:
+            env.reset()
+            hashes = []
+        hashes.append(env.unwrapped.hash())
+    env.unwrapped.disable_undo()
+
+print('testing free cell placement')
+env = gym.make('MiniGrid-Empty-8x8-v0')
+env.reset()
+env = env.unwrapped
+env.grid.wall_rect(1, 1, 6, 6)
+env.agent_pos = (3, 3)
+counts = {}
+for i in range(0, 3000):
+    # Only the 4x4 inner cells are free, minus the agent's cell and
+    # the ones the filtering criterion rejects
+    pos = env.place_obj(None, reject_fn=lambda env, pos: pos[0] == 2)
+    assert env.grid.get(*pos) is None
+    assert tuple(pos) != tuple(env.agent_pos) and pos[0] != 2
+    counts[tuple(pos)] = counts.get(tuple(pos), 0) + 1
+assert all(2 <= x <= 5 and 2 <= y <= 5 for x, y in counts)
+assert len(counts) == 11 and min(counts.values()) > 150
+
+for x in range(2, 6):
+    env.grid.vert_wall(x, 2, 4)
+try:
+    env.place_obj(Ball())
+    assert False
+except RecursionError:
+    pass
+
+print('testing object index')
+for env_name in ['MiniGrid-KeyCorridorS3R3-v0', 'MiniGrid-MTEnv-8x8-v0', 'MiniGrid-Dynamic-Obstacles-8x8-v0']:
+    env = gym.make(env_name)
+    env.reset()
+    for i in range(0, 200):
+        action = random.randint(0, env.action_space.n - 1)
+        obs, reward, done, info = env.step(action)
+        if done:
+            env.reset()
+        grid = env.unwrapped.grid
+        for obj_type in ['wall', 'door', 'key', 'ball', 'box', 'goal', 'floor']:
+            positions = [
+                (i, j) for i in range(grid.width) for j in range(grid.height)
+                if grid.get(i, j) is not None and grid.get(i, j).type == obj_type
+            ]
+            assert sorted(grid.find(obj_type)) == sorted(positions)
+            assert grid.count(obj_type) == len(positions)
+            for i, j in positions:
+                obj = grid.get(i, j)
+                assert (i, j) in grid.find(obj_type, obj.color)
+                assert obj in grid and (obj.color, obj_type) in grid
+
+print('testing observation buffers')
+for env_name in ['MiniGrid-KeyCorridorS3R3-v0', 'MiniGrid-Dynamic-Obstacles-8x8-v0']:
+    env = gym.make(env_name)
+    buf_env = gym.make(env_name)
+    env.seed(3)
+    buf_env.seed(3)
+    obs = env.reset()
+    buf_env.unwrapped.obs_buffer = buf_env.unwrapped.gen_obs()
+    buf_obs = buf_env.reset()
+    image = buf_obs['image']
+    for i in range(0, 200):
+        # The same dictionary and image array are returned every time
+        assert buf_obs is buf_env.unwrapped.obs_buffer
+        assert buf_obs['image'] is image
+        assert np.array_equal(buf_obs['image'], obs['image'])
+        assert buf_obs['direction'] == obs['direction']
+        action = random.randint(0, env.action_space.n - 1)
+        obs, reward, done, info = env.step(action)
+        buf_obs, buf_reward, buf_done, buf_info = buf_env.step(action)
+        if done:
+            obs = env.reset()
+            buf_obs = buf_env.reset()
+
+# The view window and the visibility mask are reused when writing into a
+# buffer, and copies of the environment get their own
+_, vis_mask = buf_env.unwrapped.gen_obs_image(image)
+assert buf_env.unwrapped.gen_obs_image(image)[1] is vis_mask
+assert buf_env.unwrapped.gen_obs_image()[1] is not vis_mask
+env_copy = copy.deepcopy(buf_env.unwrapped)
+env_copy.obs_buffer = None
+for i in range(0, 20):
+    action = random.randint(0, env.action_space.n - 1)
+    obs, _, _, _ = env_copy.step(action)
+    buf_obs, _, _, _ = buf_env.step(action)
+    assert np.array_equal(buf_obs['image'], obs['image'])
+
+print('testing vectorized rendering predicates')
+from gym_minigrid.rendering import *
+predicates = [
+    point_in_rect(0.12, 0.88, 0.47, 0.53),
+    point_in_circle(0.56, 0.28, 0.19),
+    point_in_line(0.1, 0.3, 0.3, 0.65, r=0.03),
+    rotate_fn(point_in_triangle((0.12, 0.19), (0.87, 0.50), (0.12, 0.81)), cx=0.5, cy=0.5, theta=0.5*math.pi),
+]
+for fn in predicates:
+    # Evaluating on all pixels at once matches evaluating pixel by pixel
+    img = fill_coords(np.zeros((24, 24, 3), dtype=np.uint8), fn, (255, 0, 0))
+    for y in range(24):
+        for x in range(24):
+            assert bool(fn((x + 0.5) / 24, (y + 0.5) / 24)) == (img[y, x, 0] == 255)
+
+print('testing tile atlas')
+import tempfile
+atlas = TileAtlas.build(8)
+for obj in [None, Wall(), Door('red', is_open=True), Door('blue', is_locked=True), Key('yellow'), Lava()]:
+    for agent_dir in [None, 0, 3]:
+        for highlight in [False, True]:
+            tile = Grid.render_tile(obj, agent_dir, highlight, 8)
+            assert np.array_equal(atlas.tile(obj, agent_dir, highlight), tile)
+with tempfile.TemporaryDirectory() as tmp_dir:
+    for file_name in ['atlas.npy', 'atlas.npz']:
+        path = os.path.join(tmp_dir, file_name)
+        atlas.save(path)
+        loaded = TileAtlas.load(path)
+        assert np.array_equal(loaded.tiles, atlas.tiles)
+        del loaded
+env = gym.make('MiniGrid-KeyCorridorS3R3-v0')
+env.reset()
+img = env.render('rgb_array', tile_size=8)
+Grid.use_atlas(atlas)
+assert np.array_equal(env.render('rgb_array', tile_size=8), img)
+Grid.tile_atlases.clear()
+
+print('testing gather-based rendering')
+for env_name in ['MiniGrid-KeyCorridorS3R3-v0', 'MiniGrid-LavaCrossingS9N1-v0']:
+    env = gym.make(env_name)
+    env.reset()
+    for i in range(0, 20):
+        grid = env.unwrapped.grid
+        agent_pos = env.unwrapped.agent_pos
+        highlight_mask = np.random.randint(0, 2, size=(grid.width, grid.height)).astype(bool)
+        img = grid.render(8, agent_pos, env.unwrapped.agent_dir, highlight_mask)
+        for j in range(grid.height):
+            for i in range(grid.width):
+                agent_here = np.array_equal(agent_pos, (i, j))
+                tile = Grid.draw_tile(
+                    grid.get(i, j),
+                    env.unwrapped.agent_dir if agent_here else None,
+                    highlight_mask[i, j],
+                    8
+                )
+                assert np.array_equal(img[j*8:(j+1)*8, i*8:(i+1)*8], tile)
+        action = random.randint(0, env.action_space.n - 1)
+        obs, reward, done, info = env.step(action)
+        if done:
+            env.reset()
+
+print('testing incremental rendering')
+env = gym.make('MiniGrid-KeyCorridorS3R3-v0')
+env.reset()
+env.unwrapped.reuse_frames = True
+frame = env.render('rgb_array', tile_size=8)
+for i in range(0, 100):
+    action = random.randint(0, env.action_space.n - 1)
+    obs, reward, done, info = env.step(action)
+    if done:
+        env.reset()
+    # The same frame is updated in place and matches a full render
+    assert env.render('rgb_array', tile_size=8) is frame
+    env_u = env.unwrapped
+    _, vis_mask = env_u.gen_obs_image()
+    highlight_mask = np.zeros((env_u.width, env_u.height), dtype=bool)
+    for x in range(env_u.width):
+        for y in range(env_u.height):
+            if env_u.in_view(x, y):
+                highlight_mask[x, y] = vis_mask[env_u.relative_coords(x, y)]
+    assert np.array_equal(env_u.get_highlight_mask(), highlight_mask)
+    assert np.array_equal(frame, env_u.grid.render(8, env_u.agent_pos, env_u.agent_dir, highlight_mask))
+
+print('testing get_obs_render')
+env = gym.make('MiniGrid-KeyCorridorS3R3-v0')
+obs = env.reset()
+for i in range(0, 50):
+    grid, vis_mask = Grid.decode(obs['image'])
+    img = grid.render(8, agent_pos=(3, 6), agent_dir=3, highlight_mask=vis_mask)
+    assert np.array_equal(env.get_obs_render(obs['image'], 8), img)
+    action = random.randint(0, env.action_space.n - 1)
+    obs, reward, done, info = env.step(action)
+    if done:
+        obs = env.reset()
+# Unseen cells are drawn as empty ones, whatever their color and state
+image = np.zeros((7, 7, 3), dtype=np.uint8)
+image[:, :, 1:] = np.random.randint(0, 3, size=(7, 7, 2))
+assert np.array_equal(
+    env.get_obs_render(image, 8),
+    Grid(7, 7).render(8, agent_pos=(3, 6), agent_dir=3)
+)
+
+print('testing OneHotPartialObsWrapper')
+env = gym.make('MiniGrid-KeyCorridorS3R3-v0')
+one_hot_envs = [
+    OneHotPartialObsWrapper(gym.make('MiniGrid-KeyCorridorS3R3-v0')),
+    OneHotPartialObsWrapper(gym.make('MiniGrid-KeyCorridorS3R3-v0'), dtype='float32', reuse_buffer=True),
+    OneHotPartialObsWrapper(gym.make('MiniGrid-KeyCorridorS3R3-v0'), packed=True),
+]
+obs = env.reset()
+for i in range(0, 50):
+    img = obs['image']
+    expected = np.zeros((7, 7, len(OBJECT_TO_IDX) + len(COLOR_TO_IDX) + 3), dtype='uint8')
+    for x in range(7):
+        for y in range(7):
+            expected[x, y, img[x, y, 0]] = 1
+            expected[x, y, len(OBJECT_TO_IDX) + img[x, y, 1]] = 1
+            expected[x, y, len(OBJECT_TO_IDX) + len(COLOR_TO_IDX) + img[x, y, 2]] = 1
+    one_hot, one_hot_float, one_hot_packed = [e.observation(obs)['image'] for e in one_hot_envs]
+    assert np.array_equal(one_hot, expected)
+    assert one_hot_float.dtype == np.float32 and np.array_equal(one_hot_float, expected)
+    assert one_hot_float is one_hot_envs[1].buffer
+    unpacked = np.unpackbits(one_hot_packed, axis=-1)[:, :, :expected.shape[-1]]
+    assert np.array_equal(unpacked, expected)
+    for e, image in zip(one_hot_envs, [one_hot, one_hot_float, one_hot_packed]):
+        assert e.observation_space.spaces['image'].contains(image)
+    action = random.randint(0, env.action_space.n - 1)
+    obs, reward, done, info = env.step(action)
+    if done:
+        obs = env.reset()
+
+print('testing FlatObsWrapper')
+for reuse_buffer in [False, True]:
+    env = FlatObsWrapper(gym.make('MiniGrid-Fetch-8x8-N3-v0'), missionCacheSize=2, reuse_buffer=reuse_buffer)
+    for i in range(0, 20):
+        obs = env.reset()
+        mission = env.unwrapped.mission
+        image = env.unwrapped.gen_obs()['image']
+        img_size = image.size
+        assert np.array_equal(obs[:img_size], image.reshape(-1))
+        str_array = obs[img_size:].reshape(env.maxStrLen, env.numCharCodes)
+        for idx, ch in enumerate(mission):
+            ch_no = 26 if ch == ' ' else ord(ch) - ord('a')
+            assert str_array[idx, ch_no] == 1 and str_array[idx].sum() == 1
+        assert str_array[len(mission):].sum() == 0
+        assert len(env.missionCache) <= 2
+
+print('testing packed observations')
+for as_bytes in [False, True]:
+    env = PackedObsWrapper(FullyObsWrapper(gym.make('MiniGrid-KeyCorridorS3R3-v0')), as_bytes=as_bytes)
+    obs = env.reset()
+    images, packed = [], []
+    for i in range(0, 50):
+        image = env.env.observation(env.unwrapped.gen_obs())['image']
+        assert env.observation_space.spaces['image'].contains(obs['image'])
+        images.append(image)
+        packed.append(obs['image'])
+        action = random.randint(0, env.action_space.n - 1)
+        obs, reward, done, info = env.step(action)
+        if done:
+            obs = env.reset()
+    images = np.stack(images)
+    width, height = images.shape[1:3]
+    if as_bytes:
+        assert np.array_equal(Grid.unpack_bytes(np.stack(packed), width, height), images)
+        assert np.array_equal(Grid.unpack_bytes(packed[0].tobytes(), width, height), images[0])
+    else:
+        assert np.array_equal(Grid.unpack(np.stack(packed)), images)
+        # Packed cells are stored in their own array, of 2 bytes per cell
+        assert packed[0].flags.c_contiguous and packed[0].base is None
+        assert packed[0].nbytes == 2 * width * height
+
+print('testing frame stacking')
+env = FrameStackWrapper(gym.make('MiniGrid-MemoryS7-v0'), num_frames=3, stack_direction=True)
+obs = env.reset()
+history = [env.unwrapped.gen_obs()] * 3
+for i in range(0, 50):
+    assert np.array_equal(obs['image'], np.stack([h['image'] for h in history[-3:]]))
+    assert list(obs['direction']) == [h['direction'] for h in history[-3:]]
+    for key in ['image', 'direction']:
+        assert env.observation_space.spaces[key].contains(obs[key])
+    action = random.randint(0, env.action_space.n - 1)
+    obs, reward, done, info = env.step(action)
+    history.append(env.unwrapped.gen_obs())
+    if done:
+        obs = env.reset()
+        history = [env.unwrapped.gen_obs()] * 3
+
+# Stacking leaves the observation buffer of the environment untouched
+env = gym.make('MiniGrid-MemoryS7-v0')
+env.unwrapped.obs_buffer = env.unwrapped.gen_obs()
+env = FrameStackWrapper(env, num_frames=3)
+obs = env.reset()
+for i in range(0, 20):
+    assert env.unwrapped.obs_buffer['image'].shape == (7, 7, 3)
+    assert np.array_equal(obs['image'][-1], env.unwrapped.obs_buffer['image'])
+    obs, reward, done, info = env.step(random.randint(0, env.action_space.n - 1))
+    if done:
+        obs = env.reset()
+
+print('testing FusedObsWrapper')
+specs_and_chains = [
+    (dict(view_size=5, one_hot=True, flatten=True), lambda env: FlatObsWrapper(OneHotPartialObsWrapper(ViewSizeWrapper(env, 5)))),
+    (dict(flatten=True), lambda env: FlatObsWrapper(env)),
+    (dict(one_hot=True, dtype='float32'), lambda env: OneHotPartialObsWrapper(env, dtype='float32')),
+]
+for spec, chain in specs_and_chains:
+    fused_env = FusedObsWrapper(gym.make('MiniGrid-Fetch-8x8-N3-v0'), **spec)
+    env = chain(gym.make('MiniGrid-Fetch-8x8-N3-v0'))
+    assert fused_env.observation_space == env.observation_space
+    fused_env.seed(5)
+    env.seed(5)
+    fused_obs = fused_env.reset()
+    obs = env.reset()
+    for i in range(0, 50):
+        if isinstance(obs, dict):
+            fused_obs, obs = fused_obs['image'], obs['image']
+        assert fused_obs.dtype == obs.dtype and np.array_equal(fused_obs, obs)
+        action = random.randint(0, env.action_space.n - 1)
+        fused_obs, reward, done, info = fused_env.step(action)
+        obs, reward, done, info = env.step(action)
+        if done:
+            fused_obs = fused_env.reset()
+            obs = env.reset()
+
+print('testing visit counts')
+for wrapper in [ActionBonus, StateBonus]:
+    bonus_env = wrapper(gym.make('MiniGrid-DoorKey-5x5-v0'))
+    env = gym.make('MiniGrid-DoorKey-5x5-v0')
+    bonus_env.seed(3)
+    env.seed(3)
+    bonus_env.reset()
+    env.reset()
+    counts = {}
+    for i in range(0, 200):
+        action = random.randint(0, env.action_space.n - 1)
+        _, bonus_reward, done, _ = bonus_env.step(action)
+        _, reward, done, _ = env.step(action)
+        key = (tuple(env.agent_pos), env.agent_dir, action) if wrapper is ActionBonus else tuple(env.agent_pos)
+        counts[key] = counts.get(key, 0) + 1
+        assert abs(bonus_reward - reward - 1 / math.sqrt(counts[key])) < 1e-9
+        if done:
+            bonus_env.reset()
+            env.reset()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'counts.npy')
+        bonus_env.save(path)
+        loaded_env = wrapper(gym.make('MiniGrid-DoorKey-5x5-v0'))
+        loaded_env.load(path)
+        assert np.array_equal(loaded_env.counts.counts, bonus_env.counts.counts)
+    assert bonus_env.counts.counts.sum() == 200
+
+env = StateBonus(gym.make('MiniGrid-Empty-5x5-v0'), decay=0.5)
+env.reset()
+env.step(env.actions.forward)
+env.reset()
+assert env.counts.counts.sum() == 0.5
+env = StateBonus(gym.make('MiniGrid-Empty-5x5-v0'), episodic=True)
+env.reset()
+env.step(env.actions.forward)
+env.reset()
+assert env.counts.counts.sum() == 0
+
+# Batched visits are counted before computing their bonuses
+counts = VisitCounts((4, 4))
+bonuses = counts.visit(np.array([0, 0, 1]), np.array([1, 1, 2]))
+assert np.allclose(bonuses, [1 / math.sqrt(2), 1 / math.sqrt(2), 1])
+
+print('testing shared visit counts')
+shared_counts = SharedVisitCounts((5, 5), sync_every=4)
+worker_counts = SharedVisitCounts((5, 5), name=shared_counts.name, sync_every=4)
+for i in range(0, 10):
+    worker_counts.visit(1, 2)
+# Visits are merged into the shared table every sync_every visits
+assert shared_counts.counts[1, 2] == 8
+assert abs(worker_counts.visit(1, 2) - 1 / math.sqrt(11)) < 1e-9
+worker_counts.close()
+assert shared_counts.counts[1, 2] == 11
+env = StateBonus(gym.make('MiniGrid-Empty-5x5-v0'), counts=shared_counts)
+env.reset()
+env.step(env.actions.forward)
+shared_counts.sync()
+assert shared_counts.counts.sum() == 12
+for kwargs in [dict(episodic=True), dict(decay=0.5)]:
+    try:
+        StateBonus(gym.make('MiniGrid-Empty-5x5-v0'), counts=shared_counts, **kwargs)
+        assert False
+    except ValueError:
+        pass
+shared_counts.decay(0.5)
+assert shared_counts.counts.sum() == 6
+shared_counts.close()
+shared_counts.unlink()
+
+print('testing novelty bonus')
+sketch = CountMinSketch(width=1 << 8, depth=4)
+keys = np.random.randint(0, 1 << 62, size=100, dtype=np.int64).astype(np.uint64)
+for i, key in enumerate(keys):
+    for j in range(i % 3 + 1):
+        sketch.add(key)
+# Counts are never underestimated
+assert (sketch.count(keys) >= np.arange(100) % 3 + 1).all()
+bloom = BloomFilter(num_bits=1 << 12)
+assert not bloom.add(keys).any() and bloom.add(keys).all()
+assert all(int(key) in bloom for key in keys)
+bloom.clear()
+assert int(keys[0]) not in bloom
+
+env = NoveltyBonus(gym.make('MiniGrid-Empty-5x5-v0'))
+base_env = gym.make('MiniGrid-Empty-5x5-v0')
+env.reset()
+base_env.reset()
+# Turning around in place visits four states, then revisits them
+bonuses = []
+for i in range(0, 8):
+    _, reward, _, _ = env.step(env.actions.left)
+    _, base_reward, _, _ = base_env.step(base_env.actions.left)
+    bonuses.append(reward - base_reward)
+assert np.allclose(bonuses, [1, 1, 1, 0, 0, 0, 0, 0])
+env.reset()
+_, reward, _, _ = env.step(env.actions.left)
+assert abs(reward - 1 / math.sqrt(3)) < 1e-9